@@ -0,0 +1,23 @@
+import asyncio
+import threading
+from typing import Any, Awaitable
+
+# One long-lived event loop shared by every async client. SDK clients (grpc.aio,
+# httpx.AsyncClient) bind to the loop they were first used on, so a fresh
+# asyncio.run() per call would strand their pooled connections.
+_loop = None
+_loop_lock = threading.Lock()
+
+
+def _get_loop() -> asyncio.AbstractEventLoop:
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name="async-runner", daemon=True).start()
+        return _loop
+
+
+def run_async(coro: Awaitable[Any]) -> Any:
+    """Run a coroutine on the shared background loop and block until it finishes"""
+    return asyncio.run_coroutine_threadsafe(coro, _get_loop()).result()
@@ -0,0 +1,112 @@
+import hashlib
+import logging
+import mmap
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import List, Optional
+from config import CAPTION_CACHE_PATH, CAPTION_MEMORY_CACHE_SIZE
+
+logger = logging.getLogger(__name__)
+
+
+def hash_image(image_path: str) -> str:
+    """Content hash of an image file, used as its caption cache key"""
+    hasher = hashlib.sha256()
+    with open(image_path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:  # mmap can't map empty files
+            return hasher.hexdigest()
+        # Hash the page-cache mapping directly instead of copying the file into Python
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            hasher.update(mm)
+    return hasher.hexdigest()
+
+
+class CachedCaptioner:
+    """Read-through caption cache keyed by (image sha256, caption model), wrapping any captioning client."""
+
+    def __init__(self, captioner, cache_path: Path = CAPTION_CACHE_PATH, model_id: str = None):
+        self.captioner = captioner
+        # Part of the key, so switching caption providers never serves another model's captions
+        self.model_id = model_id or getattr(captioner, "model_name", type(captioner).__name__)
+        self.cache_path = Path(cache_path)
+        self.cache_path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()  # in-process LRU of recent hits
+        self._conn = sqlite3.connect(str(self.cache_path), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS captions ("
+            " sha256 TEXT NOT NULL,"
+            " model TEXT NOT NULL,"
+            " caption TEXT NOT NULL,"
+            " ts INTEGER NOT NULL,"
+            " PRIMARY KEY (sha256, model))"
+        )
+        self._conn.commit()
+
+    def _remember(self, image_hash: str, caption: str):
+        self._memory[image_hash] = caption
+        self._memory.move_to_end(image_hash)
+        if len(self._memory) > CAPTION_MEMORY_CACHE_SIZE:
+            self._memory.popitem(last=False)
+
+    def _lookup(self, image_hash: Optional[str]) -> Optional[str]:
+        if image_hash is None:
+            return None
+        with self._lock:
+            caption = self._memory.get(image_hash)
+            if caption is None:
+                row = self._conn.execute(
+                    "SELECT caption FROM captions WHERE sha256 = ? AND model = ?",
+                    (image_hash, self.model_id)
+                ).fetchone()
+                caption = row[0] if row else None
+            if caption is not None:
+                self._remember(image_hash, caption)
+            return caption
+
+    def _store(self, image_hash: Optional[str], caption: str):
+        # Don't persist failures, so the next run retries them
+        if image_hash is None or not caption.strip() or caption.startswith("[⚠️"):
+            return
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO captions (sha256, model, caption, ts) VALUES (?, ?, ?, ?)",
+                (image_hash, self.model_id, caption, int(time.time()))
+            )
+            self._conn.commit()
+            self._remember(image_hash, caption)
+
+    @staticmethod
+    def _hash(image_path: str) -> Optional[str]:
+        try:
+            return hash_image(image_path)
+        except OSError as e:
+            logger.warning("⚠️ Could not hash image %s: %s", image_path, e)
+            return None
+
+    def generate_image_caption(self, image_path: str) -> str:
+        return self.caption_images([image_path])[0]
+
+    def caption_images(self, image_paths: List[str]) -> List[str]:
+        """Serve cached captions and send only the misses to the wrapped client, in one batch"""
+        hashes = [self._hash(path) for path in image_paths]
+        captions = [self._lookup(image_hash) for image_hash in hashes]
+        misses = [i for i, caption in enumerate(captions) if caption is None]
+        if not misses:
+            return captions
+
+        miss_paths = [image_paths[i] for i in misses]
+        if hasattr(self.captioner, "caption_images"):
+            new_captions = self.captioner.caption_images(miss_paths)
+        else:
+            new_captions = [self.captioner.generate_image_caption(path) for path in miss_paths]
+
+        for i, caption in zip(misses, new_captions):
+            captions[i] = caption
+            self._store(hashes[i], caption)
+        return captions
@@ -1,4 +1,8 @@
+import atexit
+import logging
+import logging.handlers
 import os
+import queue
 from pathlib import Path
 from dotenv import load_dotenv
 
@@ -11,6 +15,10 @@ OPENROUTER_API_KEY =os.getenv("OPENROUTER_API_KEY")
 # Model Configuration
 EMBEDDING_MODEL = "models/text-embedding-004"  
 GEMINI_MODEL = "gemini-1.5-flash"
+EMBEDDING_BATCH_SIZE = 100  # batchEmbedContents accepts at most 100 inputs
+EMBEDDING_MAX_CONCURRENCY = 8  # embedding requests in flight at once
+EMBEDDING_MAX_RETRIES = 4  # retries with exponential backoff on 429/5xx
+EMBEDDING_RETRY_ROUNDS = 2  # extra passes over texts that still failed before they are left out of the index
 AZURE_OPENAI_API_KEY = os.getenv("AZURE_OPENAI_API_KEY")
 AZURE_OPENAI_ENDPOINT = os.getenv("AZURE_OPENAI_ENDPOINT")
 AZURE_DEPLOYMENT_NAME = os.getenv("AZURE_DEPLOYMENT_NAME")
@@ -22,13 +30,71 @@ DATA_DIR = Path("data")
 IMAGES_DIR = DATA_DIR / "images"
 VECTORS_DIR = DATA_DIR / "vectors"
 METADATA_DIR = DATA_DIR / "metadata"
+CAPTIONS_DIR = DATA_DIR / "captions"
+CAPTION_CACHE_PATH = CAPTIONS_DIR / "caption_cache.sqlite"
+EMBEDDING_CACHE_PATH = VECTORS_DIR / "embedding_cache.sqlite"
 
 # Create directories
-for dir_path in [DATA_DIR, IMAGES_DIR, VECTORS_DIR, METADATA_DIR]:
+for dir_path in [DATA_DIR, IMAGES_DIR, VECTORS_DIR, METADATA_DIR, CAPTIONS_DIR]:
     dir_path.mkdir(exist_ok=True)
 
 # Processing Configuration
 CHUNK_SIZE = 512
 CHUNK_OVERLAP = 50
 TOP_K_RETRIEVAL = 5
+PDF_PAGE_BLOCK_SIZE = 8  # pages per extraction task sent to a worker process
+IMAGE_WRITE_WORKERS = 4  # threads per extraction worker encoding and writing images
+INDEX_BATCH_SIZE = 64  # chunks per embedding micro-batch while streaming PDFs into the index
+INDEX_QUEUE_SIZE = 256  # finished PDFs waiting to be indexed before extraction blocks
+INDEX_ADD_BATCH_SIZE = 4096  # chunks embedded and added per step, bounding resident embeddings in build_index
+BRUTE_FORCE_MAX_CHUNKS = 2048  # search small indexes with a direct cosine pass
+GPU_MIN_CHUNKS = 100_000  # move flat/IVF indexes this large to the GPU when one is available
+# "flat" keeps exact float32 vectors; "sq8" encodes them as int8 codes when the index is partitioned;
+# "hnsw" builds a graph instead, for the lowest single-query latency at ~1.5x flat memory
+VECTOR_INDEX_TYPE = "sq8"
+# int8 ranges are trained once, on the vectors present at partitioning, and never retrained. Each range is
+# widened by this fraction on both sides; later vectors that still fall outside it are clipped
+SQ8_RANGE_MARGIN = 0.1
+HNSW_M = 32  # graph neighbours per vector
+HNSW_EF_CONSTRUCTION = 200  # candidate list size while inserting
+HNSW_EF_SEARCH = 64  # candidate list size per query; higher trades latency for recall
+IVF_MIN_CHUNKS = 10_000  # partition larger indexes into 4*sqrt(N) IVF lists
+IVF_NPROBE = 16  # IVF lists scanned per query
+QUERY_CACHE_SIZE = 256  # recent query embeddings whose top-k hits are reused
+QUERY_CACHE_THRESHOLD = 0.92  # cosine similarity for a rephrased query to reuse hits
+CAPTION_MAX_CONCURRENCY = 8  # in-flight captioning requests
+CAPTION_REQUESTS_PER_MINUTE = 20  # OpenRouter free-tier limit for the Qwen model
+CAPTION_MAX_RETRIES = 4  # retries with exponential backoff on 429/5xx
+CAPTION_IMAGE_MAX_EDGE = 1024  # longest side, in pixels, of images sent for captioning
+CAPTION_JPEG_QUALITY = 85  # quality for downscaled JPEG sources sent to the caption model
+CAPTION_BATCH_SIZE = 4  # images per Qwen request; keeps the reply well inside the model's context
+CAPTION_MEMORY_CACHE_SIZE = 1024  # in-process LRU of recent caption cache hits
+ANSWER_CACHE_SIZE = 256  # cached sub-query answers (LRU)
+ANSWER_ERROR_PREFIX = "Error generating answer"  # starts the text answer clients return on failure
+COMPLEX_QUERY_MIN_WORDS = 12  # longer questions are always decomposed
+COMPLEX_QUERY_MARKERS = {"and", "compare", "versus", "vs", "both", "difference", "between"}
+DECOMPOSITION_CACHE_MODEL = "BAAI/bge-small-en-v1.5"  # local encoder for the decomposition cache
+DECOMPOSITION_CACHE_THRESHOLD = 0.95  # cosine similarity needed to reuse a past decomposition
 
+# Evaluation Configuration
+EVALUATION_MAX_WORKERS = 8
+
+# Logging Configuration
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+_log_listener = None
+
+def setup_logging(level: str = LOG_LEVEL):
+    """Route all log records through a queue so callers never block on stdout"""
+    global _log_listener
+    if _log_listener is not None:  # Streamlit re-executes the script on every rerun
+        return
+    log_queue = queue.SimpleQueue()
+    console = logging.StreamHandler()
+    console.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+    _log_listener = logging.handlers.QueueListener(log_queue, console)
+    _log_listener.start()
+    atexit.register(_log_listener.stop)
+
+    root = logging.getLogger()
+    root.setLevel(level)
+    root.addHandler(logging.handlers.QueueHandler(log_queue))
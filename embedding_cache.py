@@ -0,0 +1,89 @@
+import hashlib
+import sqlite3
+import threading
+from pathlib import Path
+from typing import List, Optional, Sequence
+import numpy as np
+from config import EMBEDDING_CACHE_PATH
+
+_SQLITE_MAX_PARAMS = 500  # stay well below SQLITE_MAX_VARIABLE_NUMBER
+
+
+def content_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """Persistent embedding cache keyed by (model, task type, sha256 of content)."""
+
+    def __init__(self, path: Path = EMBEDDING_CACHE_PATH):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings_int8 ("
+            " model TEXT NOT NULL,"
+            " task_type TEXT NOT NULL,"
+            " content_hash TEXT NOT NULL,"
+            " embedding BLOB NOT NULL,"
+            " PRIMARY KEY (model, task_type, content_hash))"
+        )
+        self._conn.commit()
+
+    @staticmethod
+    def _encode(embedding) -> bytes:
+        # int8 with a per-vector float32 scale: a quarter of the float32 size,
+        # with cosine error well below retrieval noise
+        vec = np.asarray(embedding, dtype=np.float32)
+        scale = np.float32(np.abs(vec).max() / 127.0) if vec.size else np.float32(0.0)
+        if scale == 0:
+            quantized = np.zeros(vec.shape, dtype=np.int8)
+        else:
+            quantized = np.round(vec / scale).astype(np.int8)
+        return scale.tobytes() + quantized.tobytes()
+
+    @staticmethod
+    def _decode(blob: bytes) -> np.ndarray:
+        scale = np.frombuffer(blob, dtype=np.float32, count=1)[0]
+        return np.frombuffer(blob, dtype=np.int8, offset=4).astype(np.float32) * scale
+
+    def get(self, model: str, text: str, task_type: str = "") -> Optional[np.ndarray]:
+        return self.get_many(model, [text], task_type)[0]
+
+    def put(self, model: str, text: str, embedding, task_type: str = ""):
+        self.put_many(model, [text], [embedding], task_type)
+
+    def get_many(self, model: str, texts: Sequence[str], task_type: str = "") -> List[Optional[np.ndarray]]:
+        """Look up many texts at once; misses come back as None"""
+        hashes = [content_hash(text) for text in texts]
+        unique_hashes = list(dict.fromkeys(hashes))  # repeated chunks (headers, footers) are fetched once
+        found = {}
+        with self._lock:
+            for start in range(0, len(unique_hashes), _SQLITE_MAX_PARAMS):
+                batch = unique_hashes[start:start + _SQLITE_MAX_PARAMS]
+                rows = self._conn.execute(
+                    "SELECT content_hash, embedding FROM embeddings_int8"
+                    " WHERE model = ? AND task_type = ?"
+                    f" AND content_hash IN ({','.join('?' * len(batch))})",
+                    (model, task_type, *batch)
+                ).fetchall()
+                found.update(rows)
+        decoded = {h: self._decode(blob) for h, blob in found.items()}
+        return [decoded.get(h) for h in hashes]
+
+    def put_many(self, model: str, texts: Sequence[str], embeddings, task_type: str = ""):
+        rows = [
+            (model, task_type, content_hash(text), self._encode(embedding))
+            for text, embedding in zip(texts, embeddings)
+        ]
+        if not rows:
+            return
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings_int8 (model, task_type, content_hash, embedding)"
+                " VALUES (?, ?, ?, ?)",
+                rows
+            )
+            self._conn.commit()
@@ -1,81 +1,96 @@
 # evaluation.py
 
-import json
+import orjson
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-import numpy as np
-from config import GOOGLE_API_KEY
-from gemini_client import GeminiClient
+from config import GOOGLE_API_KEY, EMBEDDING_BATCH_SIZE, EVALUATION_MAX_WORKERS, setup_logging
+from gemini_client import configure_gemini
 from vector_store import VectorStore
 from pdf_processor import PDFProcessor
+from similarity import cosine_similarities
+from embedding_cache import EmbeddingCache
 import google.generativeai as genai
 
 # Configure Gemini API
-genai.configure(api_key=GOOGLE_API_KEY)
-embedding_model = genai.GenerativeModel("models/embedding-001")
+configure_gemini(GOOGLE_API_KEY)
+EVALUATION_EMBEDDING_MODEL = "models/embedding-001"
+embedding_model = genai.GenerativeModel(EVALUATION_EMBEDDING_MODEL)
+embedding_cache = EmbeddingCache()
 
 def load_ground_truth(document_name):
     gt_path = Path("data/ground_truth") / f"{document_name}.json"
     if not gt_path.exists():
         raise FileNotFoundError(f"Ground-truth file not found: {gt_path}")
-    with open(gt_path, "r", encoding="utf-8") as f:
-        return json.load(f)
+    return orjson.loads(gt_path.read_bytes())
 
 def get_embedding(text):
     """Use Gemini embedding API to get embeddings for text"""
-    response = genai.embed_content(
-        model="models/embedding-001",
-        content=text,
-        task_type="retrieval_query"
-    )
-    return response["embedding"]
+    return get_embeddings([text])[0]
+
+def get_embeddings(texts):
+    """Embed many texts with batched Gemini embedding calls, skipping cached ones"""
+    embeddings = embedding_cache.get_many(EVALUATION_EMBEDDING_MODEL, texts, "retrieval_query")
+    missing = [i for i, embedding in enumerate(embeddings) if embedding is None]
+    for start in range(0, len(missing), EMBEDDING_BATCH_SIZE):
+        batch = missing[start:start + EMBEDDING_BATCH_SIZE]
+        batch_texts = [texts[i] for i in batch]
+        response = genai.embed_content(
+            model=EVALUATION_EMBEDDING_MODEL,
+            content=batch_texts,
+            task_type="retrieval_query"
+        )
+        embedding_cache.put_many(EVALUATION_EMBEDDING_MODEL, batch_texts, response["embedding"], "retrieval_query")
+        for i, embedding in zip(batch, response["embedding"]):
+            embeddings[i] = embedding
+    return embeddings
+
+
+def generate_answer(pdf_processor, question):
+    """Run a question through the RAG pipeline and return the answer text"""
+    generated_result = pdf_processor.query(question)
+    if isinstance(generated_result, dict):
+        return generated_result.get("answer", next(iter(generated_result.values()), ""))
+    return generated_result or ""
+
+def evaluate_document(document_name, pdf_processor, gt_data=None):
+    """Score the pipeline's answers against ground truth; gt_data overrides the on-disk file"""
+    if gt_data is None:
+        gt_data = load_ground_truth(document_name)
+
+    qa_pairs = [(qa.get("question", ""), qa.get("ground_truth_answer", "")) for qa in gt_data]
+    qa_pairs = [(question, gt_answer) for question, gt_answer in qa_pairs if question and gt_answer]
+    if not qa_pairs:
+        return []
+
+    questions = [question for question, _ in qa_pairs]
+    gt_answers = [gt_answer for _, gt_answer in qa_pairs]
+
+    # Generate answers using your system (independent LLM calls, run concurrently)
+    with ThreadPoolExecutor(max_workers=EVALUATION_MAX_WORKERS) as executor:
+        generated_answers = list(executor.map(lambda q: generate_answer(pdf_processor, q), questions))
+
+    # Get embeddings for all ground-truth and generated answers in batched calls
+    embeddings = get_embeddings(gt_answers + generated_answers)
+    similarities = cosine_similarities(embeddings[:len(qa_pairs)], embeddings[len(qa_pairs):])
 
-
-
-def cosine_similarity(vec1, vec2):
-    """Compute cosine similarity between two vectors"""
-    vec1 = np.array(vec1)
-    vec2 = np.array(vec2)
-    return np.dot(vec1, vec2) / (np.linalg.norm(vec1) * np.linalg.norm(vec2) + 1e-8)
-
-def evaluate_document(document_name, pdf_processor):
-    gt_data = load_ground_truth(document_name)
     results = []
-
-    for qa in gt_data:
-        question = qa.get("question", "")
-        gt_answer = qa.get("ground_truth_answer", "")
-
-        if not question or not gt_answer:
-            continue
-
-        # Generate answer using your system
-        generated_result = pdf_processor.query(question)
-        if isinstance(generated_result, dict):
-            generated_answer = generated_result.get("answer", next(iter(generated_result.values()), ""))
-        else:
-            generated_answer = generated_result or ""
-
-        # Get embeddings
-        gt_embedding = get_embedding(gt_answer)
-        gen_embedding = get_embedding(generated_answer)
-
-        # Compute similarity
-        similarity = cosine_similarity(gt_embedding, gen_embedding)
-
+    for question, gt_answer, generated_answer, similarity in zip(
+        questions, gt_answers, generated_answers, similarities
+    ):
         results.append({
             "question": question,
             "ground_truth_answer": gt_answer,
             "generated_answer": generated_answer,
-            "similarity": similarity
+            "similarity": float(similarity)
         })
 
     return results
 
 if __name__ == "__main__":
+    setup_logging()
     document_name = "transformer_comparison"
-    gemini_client = GeminiClient(api_key=GOOGLE_API_KEY)
     vector_store = VectorStore()
-    pdf_processor = PDFProcessor(gemini_client, vector_store)
+    pdf_processor = PDFProcessor(vector_store=vector_store)  # builds its own Gemini and GPT clients
 
     results = evaluate_document(document_name, pdf_processor)
 
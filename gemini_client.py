@@ -1,19 +1,61 @@
+import functools
+import logging
+import mimetypes
 import google.generativeai as genai
-from PIL import Image
 from typing import List, Dict, Any
-from config import GEMINI_MODEL,Path
-import base64
+from config import GEMINI_MODEL, ANSWER_ERROR_PREFIX, Path
 import io
 
+logger = logging.getLogger(__name__)
+
+_CONTEXT_LABELS = {
+    'text': "Text Context {n}:\n",
+    'table': "Table Context {n} (Page {page}):\n",
+    'image': "Image Context {n} (Page {page}):\n",
+}
+
+_ANSWER_PROMPT_HEADER = """
+            Based on the following context from PDF documents, please answer the user's question.
+            
+            Context:
+            """
+
+_ANSWER_PROMPT_QUESTION = """
+            
+            Question: """
+
+_ANSWER_PROMPT_INSTRUCTIONS = """
+            
+            Instructions:
+            1. Provide a comprehensive answer based on the retrieved context
+            2. If the context includes tables, reference specific data points
+            3. If the context includes images, reference visual information
+            4. Cite which page numbers the information comes from
+            5. If the context doesn't contain enough information, say so clearly
+            
+            Answer:
+            """
+
+@functools.lru_cache(maxsize=None)
+def configure_gemini(api_key: str):
+    """Configure the SDK once per key; each configure() call drops its pooled channels"""
+    genai.configure(api_key=api_key)
+
 class GeminiClient:
     def __init__(self, api_key: str):
-        genai.configure(api_key=api_key)
+        configure_gemini(api_key)
+        self.model_name = GEMINI_MODEL
         self.model = genai.GenerativeModel(GEMINI_MODEL)
     
     def generate_image_caption(self, image_path: str) -> str:
         """Generate caption for image using Gemini Vision"""
         try:
-            image = Image.open(image_path)
+            # Send the encoded bytes as-is; decoding with Pillow only for the SDK to re-encode is wasted work
+            with open(image_path, "rb") as f:
+                image = {
+                    "mime_type": mimetypes.guess_type(image_path)[0] or "image/png",
+                    "data": f.read()
+                }
             
             prompt = """
             Analyze this image and provide a detailed description. 
@@ -30,44 +72,41 @@ class GeminiClient:
             return response.text
             
         except Exception as e:
-            print(f"Error generating caption for {image_path}: {e}")
+            logger.error("Error generating caption for %s: %s", image_path, e)
             return f"Image from {Path(image_path).name}"
     
+    def _build_answer_prompt(self, query: str, context_chunks: List[Dict[str, Any]]) -> str:
+        buf = io.StringIO()
+        buf.write(_ANSWER_PROMPT_HEADER)
+        # Prepare context
+        separator = ""
+        for i, chunk in enumerate(context_chunks):
+            label = _CONTEXT_LABELS.get(chunk['type'])
+            if label is None:
+                continue
+            buf.write(separator)
+            buf.write(label.format(n=i + 1, page=chunk.get('page_number')))
+            buf.write(chunk['content'])
+            separator = "\n\n"
+        buf.write(_ANSWER_PROMPT_QUESTION)
+        buf.write(query)
+        buf.write(_ANSWER_PROMPT_INSTRUCTIONS)
+        return buf.getvalue()
+    
     def generate_answer(self, query: str, context_chunks: List[Dict[str, Any]]) -> str:
         """Generate answer based on retrieved context"""
         try:
-            # Prepare context
-            context_parts = []
-            for i, chunk in enumerate(context_chunks):
-                if chunk['type'] == 'text':
-                    context_parts.append(f"Text Context {i+1}:\n{chunk['content']}")
-                elif chunk['type'] == 'table':
-                    context_parts.append(f"Table Context {i+1} (Page {chunk['page_number']}):\n{chunk['content']}")
-                elif chunk['type'] == 'image':
-                    context_parts.append(f"Image Context {i+1} (Page {chunk['page_number']}):\n{chunk['content']}")
-            
-            context_text = "\n\n".join(context_parts)
-            
-            prompt = f"""
-            Based on the following context from PDF documents, please answer the user's question.
-            
-            Context:
-            {context_text}
-            
-            Question: {query}
-            
-            Instructions:
-            1. Provide a comprehensive answer based on the retrieved context
-            2. If the context includes tables, reference specific data points
-            3. If the context includes images, reference visual information
-            4. Cite which page numbers the information comes from
-            5. If the context doesn't contain enough information, say so clearly
-            
-            Answer:
-            """
+            response = self.model.generate_content(self._build_answer_prompt(query, context_chunks))
+            return response.text
             
-            response = self.model.generate_content(prompt)
+        except Exception as e:
+            return f"{ANSWER_ERROR_PREFIX}: {e}"
+    
+    async def generate_answer_async(self, query: str, context_chunks: List[Dict[str, Any]]) -> str:
+        """Non-blocking variant of generate_answer for concurrent sub-queries"""
+        try:
+            response = await self.model.generate_content_async(self._build_answer_prompt(query, context_chunks))
             return response.text
             
         except Exception as e:
-            return f"Error generating answer: {e}"
\ No newline at end of file
+            return f"{ANSWER_ERROR_PREFIX}: {e}"
\ No newline at end of file
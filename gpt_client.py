@@ -1,55 +1,106 @@
-from openai import AzureOpenAI
+import functools
+import io
+import httpx
+from openai import AzureOpenAI, AsyncAzureOpenAI
 from typing import List, Dict, Any
-from config import AZURE_OPENAI_API_KEY,AZURE_OPENAI_ENDPOINT,AZURE_DEPLOYMENT_NAME,AZURE_API_VERSION
+from config import AZURE_OPENAI_API_KEY,AZURE_OPENAI_ENDPOINT,AZURE_DEPLOYMENT_NAME,AZURE_API_VERSION,ANSWER_ERROR_PREFIX
 
 
-class GPTClient:
-    """Answer generator that calls your Azure‑hosted GPT deployment."""
-    def __init__(self):
-        self.client = AzureOpenAI(
-            api_key=AZURE_OPENAI_API_KEY,
-            azure_endpoint=AZURE_OPENAI_ENDPOINT,
-            api_version=AZURE_API_VERSION,
-        )
-        self.deployment_name = AZURE_DEPLOYMENT_NAME
+_SYSTEM_PROMPT = "You are a helpful Vastu assistant."
 
-    def generate_answer(self, query: str, context_chunks: List[Dict[str, Any]]) -> str:
-        try:
-            if not context_chunks:
-                final_prompt = query
-            else:
-                context_parts = []
-                for i, c in enumerate(context_chunks):
-                    page = c.get("page_number", "N/A")
-                    if c["type"] == "text":
-                        context_parts.append(f"Text {i+1}:\n{c['content']}")
-                    elif c["type"] == "table":
-                        context_parts.append(f"Table {i+1} (p.{page}):\n{c['content']}")
-                    elif c["type"] == "image":
-                        context_parts.append(f"Image {i+1} (p.{page}):\n{c['content']}")
-                context_text = "\n\n".join(context_parts)
-                final_prompt = f"""
+_CONTEXT_LABELS = {
+    "text": "Text {n}:\n",
+    "table": "Table {n} (p.{page}):\n",
+    "image": "Image {n} (p.{page}):\n",
+}
+
+_PROMPT_HEADER = """
 Based on the following Vastu context, answer the user's question.
 
 Context:
-{context_text}
+"""
 
-Question:
-{query}
+_PROMPT_INSTRUCTIONS = """
 
 Instructions:
 - Answer **only** from the context.
 - Cite rules or page numbers when relevant.
 - If info is missing, say so.
-""".strip()
+"""
+
 
+# Keep-alive HTTP/2 pools shared by every GPTClient, so TLS handshakes are paid once per process
+_HTTP_LIMITS = httpx.Limits(max_keepalive_connections=64, max_connections=128)
+
+
+@functools.lru_cache(maxsize=None)
+def _shared_client() -> AzureOpenAI:
+    return AzureOpenAI(
+        api_key=AZURE_OPENAI_API_KEY,
+        azure_endpoint=AZURE_OPENAI_ENDPOINT,
+        api_version=AZURE_API_VERSION,
+        http_client=httpx.Client(http2=True, limits=_HTTP_LIMITS),
+    )
+
+
+@functools.lru_cache(maxsize=None)
+def _shared_async_client() -> AsyncAzureOpenAI:
+    return AsyncAzureOpenAI(
+        api_key=AZURE_OPENAI_API_KEY,
+        azure_endpoint=AZURE_OPENAI_ENDPOINT,
+        api_version=AZURE_API_VERSION,
+        http_client=httpx.AsyncClient(http2=True, limits=_HTTP_LIMITS),
+    )
+
+
+class GPTClient:
+    """Answer generator that calls your Azure‑hosted GPT deployment."""
+    def __init__(self):
+        self.client = _shared_client()
+        self.async_client = _shared_async_client()
+        self.deployment_name = AZURE_DEPLOYMENT_NAME
+
+    def _build_messages(self, query: str, context_chunks: List[Dict[str, Any]]) -> List[Dict[str, str]]:
+        if not context_chunks:
+            final_prompt = query
+        else:
+            buf = io.StringIO()
+            buf.write(_PROMPT_HEADER)
+            separator = ""
+            for i, c in enumerate(context_chunks):
+                label = _CONTEXT_LABELS.get(c["type"])
+                if label is None:
+                    continue
+                buf.write(separator)
+                buf.write(label.format(n=i + 1, page=c.get("page_number", "N/A")))
+                buf.write(c["content"])
+                separator = "\n\n"
+            buf.write("\n\nQuestion:\n")
+            buf.write(query)
+            buf.write(_PROMPT_INSTRUCTIONS)
+            final_prompt = buf.getvalue().strip()
+
+        return [
+            {"role": "system", "content": _SYSTEM_PROMPT},
+            {"role": "user", "content": final_prompt},
+        ]
+
+    def generate_answer(self, query: str, context_chunks: List[Dict[str, Any]]) -> str:
+        try:
             resp = self.client.chat.completions.create(
                 model=self.deployment_name,
-                messages=[
-                    {"role": "system", "content": "You are a helpful Vastu assistant."},
-                    {"role": "user", "content": final_prompt},
-                ],
+                messages=self._build_messages(query, context_chunks),
+            )
+            return resp.choices[0].message.content.strip()
+        except Exception as e:
+            return f"❌ {ANSWER_ERROR_PREFIX}: {e}"
+
+    async def generate_answer_async(self, query: str, context_chunks: List[Dict[str, Any]]) -> str:
+        try:
+            resp = await self.async_client.chat.completions.create(
+                model=self.deployment_name,
+                messages=self._build_messages(query, context_chunks),
             )
             return resp.choices[0].message.content.strip()
         except Exception as e:
-            return f"❌ Error generating answer: {e}"
+            return f"❌ {ANSWER_ERROR_PREFIX}: {e}"
@@ -1,96 +1,209 @@
+import logging
 from pathlib import Path
-import json
-from typing import List, Dict, Any
+from collections import OrderedDict
+import asyncio
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import orjson
+import os
+import queue
+import threading
+from typing import Callable, List, Dict, Any, Tuple
 from qwen_client import QwenClient
+from caption_cache import CachedCaptioner
 from gemini_client import GeminiClient
 from gpt_client import GPTClient
 from vector_store import VectorStore
 from query_decomposer import QueryDecomposer
-from config import TOP_K_RETRIEVAL, GOOGLE_API_KEY
+from async_runner import run_async
+from config import (
+    TOP_K_RETRIEVAL,
+    GOOGLE_API_KEY,
+    CAPTIONS_DIR,
+    ANSWER_CACHE_SIZE,
+    ANSWER_ERROR_PREFIX,
+    COMPLEX_QUERY_MIN_WORDS,
+    COMPLEX_QUERY_MARKERS,
+    INDEX_BATCH_SIZE,
+    INDEX_QUEUE_SIZE,
+)
 from utils import (
-    extract_images_from_pdf,
-    extract_tables_from_pdf,
-    extract_text_from_pdf,
+    extract_all_from_pdf,
+    extract_page_block,
+    merge_page_blocks,
+    page_blocks,
     save_metadata,
+    POOL_CONTEXT,
 )
 
+logger = logging.getLogger(__name__)
+
 
 class PDFProcessor:
-    def __init__(self, vector_store: VectorStore):
-        self.caption_model = QwenClient()  
+    def __init__(self, vector_store: VectorStore, caption_model: CachedCaptioner = None,
+                 query_decomposer: QueryDecomposer = None):
+        # Stateless helpers can be passed in so long-lived callers build them once
+        self.caption_model = caption_model or CachedCaptioner(QwenClient())
         self.gemini_client = GeminiClient(GOOGLE_API_KEY)
         self.gpt_client = GPTClient()
         self.vector_store = vector_store
-        self.query_decomposer = QueryDecomposer()
+        self.query_decomposer = query_decomposer or QueryDecomposer()
         self.all_chunks = []
+        self._index_failures = []  # (chunks, error) for micro-batches the indexer could not add
+        # (model, sub_query, retrieved chunks) -> answer, evicted least-recently-used
+        self._answer_cache = OrderedDict()
+        self._answer_cache_lock = threading.Lock()
 
-    def process_pdf(self, pdf_path: str) -> Dict[str, int]:
+    def process_pdf(self, pdf_path: str, chunk_sink: Callable[[List[Dict[str, Any]]], None] = None) -> Dict[str, int]:
 
-        print(f"\n📄 Processing PDF: {pdf_path}")
+        logger.info("📄 Processing PDF: %s", pdf_path)
 
-        # Text
-        text_chunks = extract_text_from_pdf(pdf_path)
-        print(f"📝 Text chunks: {len(text_chunks)}")
-
-        # Images
-        image_chunks = extract_images_from_pdf(pdf_path)
-        image_captions = []  # ⬅️ Store for JSON log
+        # Text, images and tables in a single pass over the document
+        extracted = extract_all_from_pdf(pdf_path)
+        result, all_chunks = self._finish_pdf(pdf_path, *extracted)
+        self.all_chunks.extend(all_chunks)
+        if chunk_sink:
+            chunk_sink(all_chunks)
+        return result
 
-        for chunk in image_chunks:
-            if chunk['image_path']:
-                print(f"🖼️ Captioning image: {chunk['image_path']}")
-                caption = self.caption_model.generate_image_caption(chunk['image_path'])
-                chunk['content'] = caption
+    def _finish_pdf(self, pdf_path: str, text_chunks: List[Dict[str, Any]],
+                    image_chunks: List[Dict[str, Any]],
+                    table_chunks: List[Dict[str, Any]]) -> Tuple[Dict[str, int], List[Dict[str, Any]]]:
+        """Caption images and persist metadata for already-extracted chunks"""
+        doc_name = Path(pdf_path).stem
+        logger.info("📝 Text chunks: %s", len(text_chunks))
 
-                image_captions.append({
-                    "image_path": chunk['image_path'],
-                    "caption": caption
-                })
+        # Images
+        image_captions = self.caption_images(image_chunks)  # ⬅️ Store for JSON log
 
-        print(f"🖼️ Image chunks: {len(image_chunks)}")
+        logger.info("🖼️ Image chunks: %s", len(image_chunks))
 
         # Save image captions to JSON
         if image_captions:
-            captions_filename = f"captions_{Path(pdf_path).stem}.json"
-            captions_path = Path("data/captions") / captions_filename
-            captions_path.parent.mkdir(parents=True, exist_ok=True)
+            captions_filename = f"captions_{doc_name}.json"
+            captions_path = CAPTIONS_DIR / captions_filename
 
-            with open(captions_path, "w", encoding="utf-8") as f:
-                json.dump(image_captions, f, indent=2, ensure_ascii=False)
+            captions_path.write_bytes(orjson.dumps(image_captions, option=orjson.OPT_INDENT_2))
 
-            print(f"📝 Saved image captions ➜ {captions_path}")
+            logger.info("📝 Saved image captions ➜ %s", captions_path)
 
         # Tables
-        table_chunks = extract_tables_from_pdf(pdf_path)
-        print(f"📊 Table chunks: {len(table_chunks)}")
+        logger.info("📊 Table chunks: %s", len(table_chunks))
 
         # Final combination
         all_chunks = text_chunks + image_chunks + table_chunks
-        self.all_chunks.extend(all_chunks)
 
-        doc_name = Path(pdf_path).stem
         save_metadata(all_chunks, doc_name)
 
-        print(f"📦 Total chunks: {len(all_chunks)}")
+        logger.info("📦 Total chunks: %s", len(all_chunks))
 
         return {
             'text_chunks': len(text_chunks),
             'image_chunks': len(image_chunks),
             'table_chunks': len(table_chunks),
             'total_chunks': len(all_chunks)
-        }
-
-
-
-    def process_multiple_pdfs(self, pdf_paths: List[str]) -> Dict[str, Any]:
+        }, all_chunks
+
+
+
+    def caption_images(self, image_chunks: List[Dict[str, Any]]) -> List[Dict[str, str]]:
+        """Caption all image chunks of a document in one concurrent batch."""
+        chunks_to_caption = [chunk for chunk in image_chunks if chunk['image_path']]
+        if not chunks_to_caption:
+            return []
+
+        logger.info("🖼️ Captioning %s images", len(chunks_to_caption))
+        captions = self.caption_model.caption_images([chunk['image_path'] for chunk in chunks_to_caption])
+        for chunk, caption in zip(chunks_to_caption, captions):
+            chunk['content'] = caption
+
+        return [
+            {"image_path": chunk['image_path'], "caption": chunk['content']}
+            for chunk in chunks_to_caption
+        ]
+
+    def process_multiple_pdfs(self, pdf_paths: List[str],
+                              progress_callback: Callable[[int, int], None] = None,
+                              chunk_sink: Callable[[List[Dict[str, Any]]], None] = None) -> Dict[str, Any]:
+        """Process PDFs; progress_callback(done, total) and chunk_sink(chunks) are called as each PDF finishes"""
+        if len(pdf_paths) <= 1:
+            return self._process_pdfs_serially(pdf_paths, progress_callback, chunk_sink)
+
+        # CPU-bound extraction runs in worker processes; captioning (network I/O)
+        # stays in this process on threads as each extraction completes.
+        # Page blocks of every PDF share one pool, so large and small files balance across cores.
+        outcomes = {}
+        blocks = {}
+        for pdf_path in pdf_paths:
+            logger.info("📄 Processing PDF: %s", pdf_path)
+            try:
+                blocks[pdf_path] = page_blocks(pdf_path)
+                if not blocks[pdf_path]:  # no pages, nothing to extract
+                    outcomes[pdf_path] = self._finish_pdf(pdf_path, [], [], [])
+            except Exception as e:
+                logger.error("❌ Error processing %s: %s", pdf_path, e)
+                outcomes[pdf_path] = ({'error': str(e)}, [])
+        if outcomes and progress_callback:
+            progress_callback(len(outcomes), len(pdf_paths))
+
+        # PDFs finish in any order, but the sink is fed in input order so index positions are reproducible
+        emitted = 0
+
+        def emit_finished():
+            nonlocal emitted
+            while emitted < len(pdf_paths) and pdf_paths[emitted] in outcomes:
+                chunks = outcomes[pdf_paths[emitted]][1]
+                if chunk_sink and chunks:
+                    chunk_sink(chunks)
+                emitted += 1
+
+        emit_finished()
+
+        max_workers = max(1, min(sum(map(len, blocks.values())), os.cpu_count() or 1))
+        with ProcessPoolExecutor(max_workers=max_workers, mp_context=POOL_CONTEXT) as executor:
+            futures = {}
+            parts = {}
+            for pdf_path, pdf_blocks in blocks.items():
+                parts[pdf_path] = [None] * len(pdf_blocks)
+                for i, block in enumerate(pdf_blocks):
+                    futures[executor.submit(extract_page_block, pdf_path, block)] = (pdf_path, i)
+
+            for future in as_completed(futures):
+                pdf_path, i = futures[future]
+                if pdf_path in outcomes:  # an earlier block of this PDF failed
+                    continue
+                try:
+                    parts[pdf_path][i] = future.result()
+                    if all(part is not None for part in parts[pdf_path]):
+                        outcomes[pdf_path] = self._finish_pdf(pdf_path, *merge_page_blocks(parts.pop(pdf_path)))
+                except Exception as e:
+                    logger.error("❌ Error processing %s: %s", pdf_path, e)
+                    outcomes[pdf_path] = ({'error': str(e)}, [])
+                if pdf_path in outcomes:
+                    emit_finished()
+                    if progress_callback:
+                        progress_callback(len(outcomes), len(pdf_paths))
+
+        # Aggregate in input order so the index layout doesn't depend on timing
         results = {}
         for pdf_path in pdf_paths:
+            result, all_chunks = outcomes[pdf_path]
+            self.all_chunks.extend(all_chunks)
+            results[Path(pdf_path).stem] = result
+        return results
+
+    def _process_pdfs_serially(self, pdf_paths: List[str],
+                               progress_callback: Callable[[int, int], None] = None,
+                               chunk_sink: Callable[[List[Dict[str, Any]]], None] = None) -> Dict[str, Any]:
+        results = {}
+        for done, pdf_path in enumerate(pdf_paths, start=1):
+            doc_name = Path(pdf_path).stem
             try:
-                result = self.process_pdf(pdf_path)
-                results[Path(pdf_path).stem] = result
+                results[doc_name] = self.process_pdf(pdf_path, chunk_sink)
             except Exception as e:
-                print(f"❌ Error processing {pdf_path}: {e}")
-                results[Path(pdf_path).stem] = {'error': str(e)}
+                logger.error("❌ Error processing %s: %s", pdf_path, e)
+                results[doc_name] = {'error': str(e)}
+            if progress_callback:
+                progress_callback(done, len(pdf_paths))
         return results
 
     def build_vector_index(self):
@@ -98,69 +211,127 @@ class PDFProcessor:
             self.vector_store.build_index(self.all_chunks)
             self.vector_store.save_index("multimodal_rag")
 
+    def process_and_index_pdfs(self, pdf_paths: List[str],
+                               progress_callback: Callable[[int, int], None] = None) -> Dict[str, Any]:
+        """Process PDFs while a background thread embeds each finished PDF's chunks into the index"""
+        chunk_queue = queue.Queue(maxsize=INDEX_QUEUE_SIZE)
+        self.vector_store.reset()
+        self.all_chunks = []  # kept in step with the index being rebuilt
+        self._index_failures = []
+        indexer = threading.Thread(target=self._index_from_queue, args=(chunk_queue,), daemon=True)
+        indexer.start()
+        try:
+            results = self.process_multiple_pdfs(pdf_paths, progress_callback, chunk_sink=chunk_queue.put)
+        finally:
+            chunk_queue.put(None)  # no more PDFs
+            indexer.join()
+
+        # A PDF whose chunks didn't all reach the index is reported as failed, not as processed
+        for chunks, error in self._index_failures:
+            for doc_name in dict.fromkeys(chunk.get('doc_name') for chunk in chunks):
+                if doc_name in results and 'error' not in results[doc_name]:
+                    results[doc_name] = {'error': f"Indexing failed: {error}"}
+
+        if self.vector_store.index is None:
+            logger.warning("⚠️ No valid content found for indexing.")
+        else:
+            logger.info("✅ Built index with %s valid chunks", len(self.vector_store.chunks))
+            self.vector_store.save_index("multimodal_rag")
+        return results
+
+    def _index_from_queue(self, chunk_queue: queue.Queue):
+        """Consume chunk lists and add them to the vector store in micro-batches"""
+        batch = []
+        while True:
+            try:
+                chunks = chunk_queue.get(timeout=1)
+            except queue.Empty:
+                chunks = []  # idle: flush whatever is waiting
+            if chunks is None:
+                break
+            batch.extend(chunks)
+            while len(batch) >= INDEX_BATCH_SIZE or (batch and not chunks):
+                self._add_to_index(batch[:INDEX_BATCH_SIZE])
+                batch = batch[INDEX_BATCH_SIZE:]
+        if batch:
+            self._add_to_index(batch)
+
+    def _add_to_index(self, chunks: List[Dict[str, Any]]):
+        try:
+            self.vector_store.add_chunks(chunks)
+        except Exception as e:
+            logger.error("❌ Error indexing %s chunks: %s", len(chunks), e)
+            self._index_failures.append((chunks, str(e)))
+
     def query(self, question: str, selected_model: str = "Gemini") -> Dict[str, Any]:
-        print(f"\n" + "=" * 60)
-        print(f"🚀 PROCESSING QUERY: '{question}' using model ➜ {selected_model}")
-        print("=" * 60)
+        logger.info("=" * 60)
+        logger.info("🚀 PROCESSING QUERY: '%s' using model ➜ %s", question, selected_model)
+        logger.info("=" * 60)
 
-        result = self.query_complex(question, selected_model=selected_model)
+        if self._is_complex_query(question):
+            result = self.query_complex(question, selected_model=selected_model)
+        else:
+            result = self.query_simple(question, selected_model=selected_model)
 
-        print(f"\n✅ Query complete using ➜ {result['method']} method")
+        logger.info("✅ Query complete using ➜ %s method", result['method'])
         return result
 
+    @staticmethod
+    def _is_complex_query(question: str) -> bool:
+        """Cheap heuristic: long or multi-part questions are worth decomposing"""
+        words = question.lower().split()
+        return len(words) > COMPLEX_QUERY_MIN_WORDS or any(
+            word.strip("?,.!;:") in COMPLEX_QUERY_MARKERS for word in words
+        )
+
+    @staticmethod
+    def _unique_image_chunks(chunks: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        unique_image_chunks = {}
+        for chunk in chunks:
+            if chunk.get("type") == "image":
+                path = chunk.get("image_path")
+                if path and path not in unique_image_chunks:
+                    unique_image_chunks[path] = chunk
+        return list(unique_image_chunks.values())
+
+    def query_simple(self, question: str, selected_model: str = "Gemini") -> Dict[str, Any]:
+        """Single retrieval + single LLM call, skipping decomposition and recombination"""
+        logger.info("🟢 Simple query, answering directly: '%s'", question)
+        sub_answer, relevant_chunks = run_async(self._answer_sub_query(1, question, selected_model))
+
+        if relevant_chunks:
+            final_answer = sub_answer['answer']
+        else:
+            final_answer = "No relevant information found in the documents to answer your query."
+
+        return {
+            "answer": final_answer,
+            "method": "simple",
+            "sub_queries": [],
+            "sub_answers": [],
+            "total_chunks_collected": len(relevant_chunks),
+            "reranked_chunks_used": len(relevant_chunks),
+            "relevant_image_chunks": self._unique_image_chunks(relevant_chunks)
+        }
+
     def query_complex(self, question: str, selected_model: str = "Gemini") -> Dict[str, Any]:
-        print(f"\n🔴 Complex query breakdown: '{question}'")
+        logger.info("🔴 Complex query breakdown: '%s'", question)
         sub_queries = self.query_decomposer.decompose_query(question)
 
+        sub_results = run_async(self._answer_sub_queries(sub_queries, selected_model))
+
         all_chunks_collected = []
         sub_query_answers = []
-
-        for i, sub_query in enumerate(sub_queries, 1):
-            print(f"\n🔍 Sub-query {i}: '{sub_query}'")
-            relevant_chunks = self.vector_store.search(sub_query, TOP_K_RETRIEVAL)
-
-            if relevant_chunks:
-                print(f"📊 Found {len(relevant_chunks)} chunks")
-                for j, chunk in enumerate(relevant_chunks, 1):
-                    score = chunk.get('similarity_score', 0)
-                    chunk_type = chunk.get('type', 'unknown')
-                    page = chunk.get('page_number', 'N/A')
-                    print(f"   {j}. {chunk_type.upper()} | Page {page} | Score: {score:.4f}")
-
-                # 🔀 Model selection
-                if selected_model == "GPT":
-                    sub_answer = self.gpt_client.generate_answer(sub_query, relevant_chunks)
-                else:
-                    sub_answer = self.gemini_client.generate_answer(sub_query, relevant_chunks)
-
-                sub_query_answers.append({
-                    'question': sub_query,
-                    'answer': sub_answer,
-                    'chunks_count': len(relevant_chunks)
-                })
-
-                all_chunks_collected.extend(relevant_chunks)
-                print(f"✅ Answered sub-query {i} (length: {len(sub_answer)} chars)")
-            else:
-                print(f"❌ No relevant chunks found for sub-query {i}")
-                sub_query_answers.append({
-                    'question': sub_query,
-                    'answer': f"No relevant information found for: {sub_query}",
-                    'chunks_count': 0
-                })
+        for sub_answer, relevant_chunks in sub_results:
+            sub_query_answers.append(sub_answer)
+            all_chunks_collected.extend(relevant_chunks)
 
         if all_chunks_collected:
             reranked_chunks = self.query_decomposer.rerank_chunks(all_chunks_collected, question)
         else:
             reranked_chunks = []
 
-        unique_image_chunks = {}
-        for chunk in all_chunks_collected:
-            if chunk.get("type") == "image":
-                path = chunk.get("image_path")
-                if path and path not in unique_image_chunks:
-                    unique_image_chunks[path] = chunk
-        relevant_image_chunks = list(unique_image_chunks.values())
+        relevant_image_chunks = self._unique_image_chunks(all_chunks_collected)
 
         if sub_query_answers and any(qa['chunks_count'] > 0 for qa in sub_query_answers):
             final_answer = self.query_decomposer.combine_answers(question, sub_query_answers)
@@ -178,3 +349,72 @@ class PDFProcessor:
             "reranked_chunks_used": len(reranked_chunks),
             "relevant_image_chunks": relevant_image_chunks
         }
+
+    async def _answer_sub_queries(self, sub_queries: List[str],
+                                  selected_model: str) -> List[Tuple[Dict[str, Any], List[Dict[str, Any]]]]:
+        return await asyncio.gather(*[
+            self._answer_sub_query(i, sub_query, selected_model)
+            for i, sub_query in enumerate(sub_queries, 1)
+        ])
+
+    async def _answer_sub_query(self, i: int, sub_query: str,
+                                selected_model: str = "Gemini") -> Tuple[Dict[str, Any], List[Dict[str, Any]]]:
+        logger.info("🔍 Sub-query %s: '%s'", i, sub_query)
+        relevant_chunks = await asyncio.to_thread(self.vector_store.search, sub_query, TOP_K_RETRIEVAL)
+
+        if not relevant_chunks:
+            logger.warning("❌ No relevant chunks found for sub-query %s", i)
+            answer = f"No relevant information found for: {sub_query}"
+            return {
+                'question': sub_query,
+                'answer': answer,
+                'answer_length': len(answer),
+                'chunks_count': 0
+            }, []
+
+        logger.info("📊 Found %s chunks", len(relevant_chunks))
+        for j, chunk in enumerate(relevant_chunks, 1):
+            score = chunk.get('similarity_score', 0)
+            chunk_type = chunk.get('type', 'unknown')
+            page = chunk.get('page_number', 'N/A')
+            logger.debug("   %s. %s | Page %s | Score: %.4f", j, chunk_type.upper(), page, score)
+
+        cache_key = (
+            selected_model,
+            sub_query,
+            frozenset(
+                (c.get('doc_name'), c.get('page_number'), c.get('type'), c.get('content'))
+                for c in relevant_chunks
+            )
+        )
+        with self._answer_cache_lock:
+            sub_answer = self._answer_cache.get(cache_key)
+            if sub_answer is not None:
+                self._answer_cache.move_to_end(cache_key)
+
+        if sub_answer is not None:
+            logger.info("⚡ Cache hit for sub-query %s", i)
+        else:
+            # 🔀 Model selection
+            if selected_model == "GPT":
+                sub_answer = await self.gpt_client.generate_answer_async(sub_query, relevant_chunks)
+            else:
+                sub_answer = await self.gemini_client.generate_answer_async(sub_query, relevant_chunks)
+
+            # Don't cache failures, so the next identical sub-query calls the model again
+            if sub_answer.lstrip("❌ ").startswith(ANSWER_ERROR_PREFIX):
+                logger.warning("⚠️ Not caching failed answer for sub-query %s", i)
+            else:
+                with self._answer_cache_lock:
+                    self._answer_cache[cache_key] = sub_answer
+                    if len(self._answer_cache) > ANSWER_CACHE_SIZE:
+                        self._answer_cache.popitem(last=False)
+
+        answer_length = len(sub_answer)
+        logger.info("✅ Answered sub-query %s (length: %s chars)", i, answer_length)
+        return {
+            'question': sub_query,
+            'answer': sub_answer,
+            'answer_length': answer_length,
+            'chunks_count': len(relevant_chunks)
+        }, relevant_chunks
@@ -1,16 +1,59 @@
+import logging
 import google.generativeai as genai
+from gemini_client import configure_gemini
+import hashlib
 import json
-import re
+import threading
 from typing import List, Dict, Any
-from config import GEMINI_MODEL, GOOGLE_API_KEY
+from config import (
+    GEMINI_MODEL,
+    GOOGLE_API_KEY,
+    VECTORS_DIR,
+    DECOMPOSITION_CACHE_MODEL,
+    DECOMPOSITION_CACHE_THRESHOLD,
+)
+from semantic_cache import SemanticCache
+
+logger = logging.getLogger(__name__)
 
 class QueryDecomposer:
     def __init__(self, api_key: str = None):
-        genai.configure(api_key=api_key or GOOGLE_API_KEY)
+        configure_gemini(api_key or GOOGLE_API_KEY)
         self.model = genai.GenerativeModel(GEMINI_MODEL)
+        # Constrain decomposition output to a JSON array of strings
+        self._decomposition_config = genai.GenerationConfig(
+            response_mime_type="application/json",
+            response_schema=list[str]
+        )
+        self._query_encoder = None
+        self._query_encoder_lock = threading.Lock()
+        self._query_cache = None
+
+    def _embed_query(self, query: str):
+        """Embed a query with a small local model, avoiding another network hop"""
+        with self._query_encoder_lock:
+            if self._query_encoder is None:
+                from sentence_transformers import SentenceTransformer
+                self._query_encoder = SentenceTransformer(DECOMPOSITION_CACHE_MODEL)
+                self._query_cache = SemanticCache(
+                    self._query_encoder.get_sentence_embedding_dimension(),
+                    DECOMPOSITION_CACHE_THRESHOLD,
+                    path=VECTORS_DIR / "decomposition_cache"
+                )
+        return self._query_encoder.encode(query, normalize_embeddings=True)
 
     def decompose_query(self, query: str) -> List[str]:
-        print(f"\n🧩 Decomposing query into sub-queries: '{query}'")
+        logger.info("🧩 Decomposing query into sub-queries: '%s'", query)
+
+        try:
+            query_embedding = self._embed_query(query)
+            cached = self._query_cache.lookup(query_embedding)
+        except Exception as e:
+            logger.warning("⚠️ Decomposition cache unavailable: %s", e)
+            query_embedding, cached = None, None
+        if cached is not None:
+            logger.info("⚡ Reusing cached decomposition (%s sub-queries)", len(cached))
+            return list(cached)
 
         prompt = f"""
         You are an expert at breaking down complex questions into simpler, focused sub-questions.
@@ -31,47 +74,51 @@ class QueryDecomposer:
         """
 
         try:
-            response = self.model.generate_content(prompt)
-            response_text = response.text.strip()
-            json_match = re.search(r'\[.*\]', response_text, re.DOTALL)
-            if json_match:
-                sub_queries = json.loads(json_match.group())
-                print(f"✅ Decomposed into {len(sub_queries)} sub-queries:")
+            response = self.model.generate_content(prompt, generation_config=self._decomposition_config)
+            sub_queries = json.loads(response.text)
+            if isinstance(sub_queries, list) and sub_queries and all(isinstance(q, str) for q in sub_queries):
+                logger.info("✅ Decomposed into %s sub-queries:", len(sub_queries))
                 for i, sub_query in enumerate(sub_queries, 1):
-                    print(f"   {i}. {sub_query}")
+                    logger.info("   %s. %s", i, sub_query)
+                if query_embedding is not None:
+                    self._query_cache.insert(query_embedding, sub_queries)
                 return sub_queries
             else:
-                print("❌ Failed to extract JSON from decomposition response")
+                logger.error("❌ Decomposition response was not a non-empty list of strings")
                 return [query]
         except Exception as e:
-            print(f"❌ Error in query decomposition: {e}")
+            logger.error("❌ Error in query decomposition: %s", e)
             return [query]
 
     def rerank_chunks(self, all_chunks: List[Dict[str, Any]], original_query: str) -> List[Dict[str, Any]]:
-        print(f"\n🔄 Reranking {len(all_chunks)} chunks for original query")
+        logger.info("🔄 Reranking %s chunks for original query", len(all_chunks))
 
         seen_content = set()
         unique_chunks = []
         for chunk in all_chunks:
-            content_hash = hash(chunk['content'])
+            if chunk.get('type') == 'image' and chunk.get('image_path'):
+                # Image captions are identified by their source image; skip hashing the caption
+                content_hash = ('image', chunk['image_path'], chunk.get('page_number'))
+            else:
+                content_hash = hashlib.blake2b(chunk['content'].encode('utf-8'), digest_size=8).digest()
             if content_hash not in seen_content:
                 seen_content.add(content_hash)
                 unique_chunks.append(chunk)
 
-        print(f"📊 Removed {len(all_chunks) - len(unique_chunks)} duplicate chunks")
+        logger.info("📊 Removed %s duplicate chunks", len(all_chunks) - len(unique_chunks))
 
         reranked_chunks = sorted(unique_chunks, key=lambda x: x.get('similarity_score', 0), reverse=True)
         top_chunks = reranked_chunks[:8]
-        print(f"📈 Selected top {len(top_chunks)} chunks after reranking")
+        logger.info("📈 Selected top %s chunks after reranking", len(top_chunks))
         for i, chunk in enumerate(top_chunks, 1):
             score = chunk.get('similarity_score', 0)
             chunk_type = chunk.get('type', 'unknown')
             page = chunk.get('page_number', 'N/A')
-            print(f"   {i}. Type: {chunk_type}, Page: {page}, Score: {score:.4f}")
+            logger.debug("   %s. Type: %s, Page: %s, Score: %.4f", i, chunk_type, page, score)
         return top_chunks
 
     def combine_answers(self, original_query: str, sub_query_answers: List[Dict[str, Any]]) -> str:
-        print(f"\n🔗 Combining {len(sub_query_answers)} sub-query answers")
+        logger.info("🔗 Combining %s sub-query answers", len(sub_query_answers))
 
         sub_answers_text = []
         for i, qa in enumerate(sub_query_answers, 1):
@@ -102,11 +149,11 @@ class QueryDecomposer:
         try:
             response = self.model.generate_content(prompt)
             final_answer = response.text.strip()
-            print("✅ Successfully combined sub-query answers into final response")
-            print(f"📝 Final answer length: {len(final_answer)} characters")
+            logger.info("✅ Successfully combined sub-query answers into final response")
+            logger.info("📝 Final answer length: %s characters", len(final_answer))
             return final_answer
         except Exception as e:
-            print(f"❌ Error combining answers: {e}")
+            logger.error("❌ Error combining answers: %s", e)
             fallback_answer = f"Based on the analysis of your question '{original_query}':\n\n"
             for qa in sub_query_answers:
                 fallback_answer += f"• {qa['question']}\n{qa['answer']}\n\n"
@@ -114,17 +161,18 @@ class QueryDecomposer:
 
     def log_query_flow(self, original_query: str, sub_queries: List[str],
                        sub_answers: List[Dict[str, Any]], final_answer: str):
-        print(f"\n" + "=" * 80)
-        print("📋 QUERY DECOMPOSITION FLOW SUMMARY")
-        print("=" * 80)
-        print(f"🎯 Original Query: {original_query}")
-        print(f"🧩 Decomposed into {len(sub_queries)} sub-queries:")
-        for i, sub_query in enumerate(sub_queries, 1):
-            print(f"   {i}. {sub_query}")
-        print(f"\n📊 Sub-query Results:")
+        if not logger.isEnabledFor(logging.INFO):
+            return
+        logger.info("=" * 80)
+        logger.info("📋 QUERY DECOMPOSITION FLOW SUMMARY")
+        logger.info("=" * 80)
+        logger.info("🎯 Original Query: %s", original_query)
+        logger.info("🧩 Decomposed into %s sub-queries:", len(sub_queries))
         for i, qa in enumerate(sub_answers, 1):
-            print(f"   Sub-query {i}: {qa['question']}")
-            print(f"   Answer length: {len(qa['answer'])} characters")
-            print(f"   Chunks used: {qa.get('chunks_count', 'N/A')}")
-        print(f"\n🎉 Final Answer length: {len(final_answer)} characters")
-        print("=" * 80)
+            answer_length = qa.get('answer_length')
+            if answer_length is None:
+                answer_length = len(qa['answer'])
+            logger.info("   %s. %s | Answer length: %s characters | Chunks used: %s",
+                        i, qa['question'], answer_length, qa.get('chunks_count', 'N/A'))
+        logger.info("🎉 Final Answer length: %s characters", len(final_answer))
+        logger.info("=" * 80)
@@ -1,61 +1,226 @@
-import requests
-import base64
+import asyncio
+import io
+import logging
+import mimetypes
+import os
+import tempfile
+import time
+from collections import deque
+import httpx
 from PIL import Image
-from typing import Dict, Any
-from config import OPENROUTER_API_KEY, Path
+from typing import Dict, Any, List, Tuple
+from config import (
+    OPENROUTER_API_KEY,
+    Path,
+    CAPTION_MAX_CONCURRENCY,
+    CAPTION_REQUESTS_PER_MINUTE,
+    CAPTION_MAX_RETRIES,
+    CAPTION_IMAGE_MAX_EDGE,
+    CAPTION_JPEG_QUALITY,
+    CAPTION_BATCH_SIZE,
+)
+from async_runner import run_async
+
+try:
+    from pybase64 import b64encode_as_string  # SIMD-accelerated encoder
+except ImportError:  # pybase64 is optional; fall back to the stdlib encoder
+    import base64
+
+    def b64encode_as_string(data: bytes) -> str:
+        return base64.b64encode(data).decode("ascii")
+
+logger = logging.getLogger(__name__)
+
+_RETRY_STATUSES = {429, 500, 502, 503, 504}
+_CONNECT_RETRIES = 3
+
+_CAPTION_PROMPT = (
+    "Describe this image in detail. Focus on visible objects, structure, labels, text, and any spatial patterns. "
+    "Be helpful and accurate — the output will be used as part of a document understanding pipeline."
+)
+
+_CAPTION_SEPARATOR = "###---###"
+
+_BATCH_CAPTION_PROMPT = (
+    "Describe each of the following images in detail, in the order given. For each image, focus on visible "
+    "objects, structure, labels, text, and any spatial patterns. Be helpful and accurate — the output will be "
+    f"used as part of a document understanding pipeline. Separate the descriptions with '{_CAPTION_SEPARATOR}' "
+    "and write nothing else between them."
+)
+
+
+class _RequestRateLimiter:
+    """Sliding one-minute window: waits before a request would exceed the provider's RPM."""
+
+    def __init__(self, requests_per_minute: int):
+        self.requests_per_minute = requests_per_minute
+        self._sent = deque()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                while self._sent and now - self._sent[0] >= 60:
+                    self._sent.popleft()
+                if len(self._sent) < self.requests_per_minute:
+                    self._sent.append(now)
+                    return
+                await asyncio.sleep(60 - (now - self._sent[0]))
+
 
 class QwenClient:
     def __init__(self):
         self.api_url = "https://openrouter.ai/api/v1/chat/completions"
+        self.model_name = "qwen/qwen2.5-vl-32b-instruct:free"
         self.headers = {
             "Authorization": f"Bearer {OPENROUTER_API_KEY}",
-            "HTTP-Referer": "http://localhost", 
+            "HTTP-Referer": "http://localhost",
             "Content-Type": "application/json"
         }
+        # Created lazily on the shared event loop (see async_runner)
+        self._client = None
+        self._semaphore = None
+        self._rate_limiter = None
 
-    def generate_image_caption(self, image_path: str) -> str:
-        """Use Qwen2.5-VL (via OpenRouter) to caption an image."""
+    def _ensure_async_state(self):
+        if self._client is None:
+            # Pooled keep-alive connections sized to the concurrency cap, so each image reuses a
+            # warm TLS session; the transport also retries failed connects before any response
+            transport = httpx.AsyncHTTPTransport(
+                http2=True,
+                retries=_CONNECT_RETRIES,
+                limits=httpx.Limits(
+                    max_connections=CAPTION_MAX_CONCURRENCY,
+                    max_keepalive_connections=CAPTION_MAX_CONCURRENCY,
+                    keepalive_expiry=60,
+                ),
+            )
+            self._client = httpx.AsyncClient(headers=self.headers, transport=transport, timeout=60)
+            self._semaphore = asyncio.Semaphore(CAPTION_MAX_CONCURRENCY)
+            self._rate_limiter = _RequestRateLimiter(CAPTION_REQUESTS_PER_MINUTE)
+
+    @staticmethod
+    def _load_image_bytes(image_path: str) -> Tuple[bytes, str]:
+        """(bytes, MIME type) to send, downscaled first since the vision model gains nothing from larger inputs"""
+        source = Path(image_path)
+        # Photos stay JPEG; re-encoding them as PNG would usually make the upload bigger
+        is_jpeg = source.suffix.lower() in (".jpg", ".jpeg")
+        suffix, image_format, mime_type = (".jpg", "JPEG", "image/jpeg") if is_jpeg else (".png", "PNG", "image/png")
+        downscaled = source.with_name(f"{source.stem}_{CAPTION_IMAGE_MAX_EDGE}px{suffix}")
+        if downscaled.exists() and downscaled.stat().st_mtime >= source.stat().st_mtime:
+            return downscaled.read_bytes(), mime_type
+
+        with Image.open(source) as im:
+            if max(im.size) <= CAPTION_IMAGE_MAX_EDGE:
+                return source.read_bytes(), mimetypes.guess_type(source.name)[0] or "image/png"
+            im.thumbnail((CAPTION_IMAGE_MAX_EDGE, CAPTION_IMAGE_MAX_EDGE), Image.Resampling.LANCZOS)
+            buf = io.BytesIO()
+            if is_jpeg:
+                im.save(buf, format=image_format, quality=CAPTION_JPEG_QUALITY, optimize=True)
+            else:
+                im.save(buf, format=image_format, optimize=True)
+        image_bytes = buf.getvalue()
+        # Write then rename, so a concurrent reader or a crash never sees a truncated cached image
+        fd, tmp_path = tempfile.mkstemp(dir=downscaled.parent, suffix=".tmp")
         try:
-            with open(image_path, "rb") as img_file:
-                image_bytes = img_file.read()
-                image_base64 = base64.b64encode(image_bytes).decode()
-
-            payload = {
-                "model": "qwen/qwen2.5-vl-32b-instruct:free",
-                "messages": [
-                    {
-                        "role": "user",
-                        "content": [
-                            {
-                                "type": "text",
-                                "text": (
-                                    "Describe this image in detail. Focus on visible objects, structure, labels, text, and any spatial patterns. "
-                                    "Be helpful and accurate — the output will be used as part of a document understanding pipeline."
-                                )
-                            },
-                            {
-                                "type": "image_url",
-                                "image_url": {
-                                    "url": f"data:image/png;base64,{image_base64}"
-                                }
-                            }
-                        ]
-                    }
-                ]
+            with os.fdopen(fd, "wb") as f:
+                f.write(image_bytes)
+            os.replace(tmp_path, downscaled)
+        except OSError as e:  # the cache is best effort; still send this image
+            Path(tmp_path).unlink(missing_ok=True)
+            logger.warning("⚠️ Could not cache downscaled image %s: %s", downscaled, e)
+        return image_bytes, mime_type
+
+    def _image_part(self, image_path: str) -> Dict[str, Any]:
+        image_bytes, mime_type = self._load_image_bytes(image_path)
+        image_base64 = b64encode_as_string(image_bytes)
+        return {
+            "type": "image_url",
+            "image_url": {
+                "url": f"data:{mime_type};base64,{image_base64}"
             }
+        }
+
+    def _build_payload(self, image_paths: List[str], prompt: str = _CAPTION_PROMPT) -> Dict[str, Any]:
+        return {
+            "model": self.model_name,
+            "messages": [
+                {
+                    "role": "user",
+                    "content": [{"type": "text", "text": prompt}] + [self._image_part(p) for p in image_paths]
+                }
+            ]
+        }
 
-            response = requests.post(self.api_url, headers=self.headers, json=payload)
+    async def _post_with_retry(self, payload: Dict[str, Any]) -> httpx.Response:
+        """POST with exponential backoff on rate limiting and transient server errors"""
+        for attempt in range(CAPTION_MAX_RETRIES + 1):
+            await self._rate_limiter.acquire()
+            async with self._semaphore:
+                response = await self._client.post(self.api_url, json=payload)
+            if response.status_code not in _RETRY_STATUSES or attempt == CAPTION_MAX_RETRIES:
+                return response
+            retry_after = response.headers.get("retry-after")
+            delay = float(retry_after) if retry_after and retry_after.isdigit() else 2 ** attempt
+            logger.warning("⚠️ Qwen returned %s, retrying in %ss", response.status_code, delay)
+            await asyncio.sleep(delay)
+
+    async def generate_image_caption_async(self, image_path: str) -> str:
+        """Use Qwen2.5-VL (via OpenRouter) to caption an image without blocking the loop."""
+        try:
+            self._ensure_async_state()
+            payload = await asyncio.to_thread(self._build_payload, [image_path])
+            response = await self._post_with_retry(payload)
             result = response.json()
 
             if "choices" in result:
                 caption = result["choices"][0]["message"]["content"]
                 if not caption.strip():
-                    print(f"❌ Empty caption returned by Qwen for image: {image_path}")
+                    logger.error("❌ Empty caption returned by Qwen for image: %s", image_path)
                     return "[⚠️ Caption failed]"
                 return caption
             else:
-                print(f"❌ Qwen API error response: {result}")
+                logger.error("❌ Qwen API error response: %s", result)
                 return "[⚠️ Caption error: No content]"
         except Exception as e:
-            print(f"❌ Exception in Qwen captioning: {e}")
+            logger.error("❌ Exception in Qwen captioning: %s", e)
             return f"[⚠️ Caption error: {Path(image_path).name}]"
+
+    async def generate_image_captions_batch_async(self, image_paths: List[str]) -> List[str]:
+        """Caption several images in one request, falling back to one request per image"""
+        if len(image_paths) == 1:
+            return [await self.generate_image_caption_async(image_paths[0])]
+        try:
+            self._ensure_async_state()
+            payload = await asyncio.to_thread(self._build_payload, image_paths, _BATCH_CAPTION_PROMPT)
+            response = await self._post_with_retry(payload)
+            result = response.json()
+            content = result["choices"][0]["message"]["content"] if "choices" in result else ""
+            captions = [c.strip() for c in content.strip().split(_CAPTION_SEPARATOR)]
+            if len(captions) > len(image_paths) and not captions[-1]:  # trailing separator
+                captions.pop()
+            if len(captions) == len(image_paths) and all(captions):
+                return captions
+            logger.warning("⚠️ Batched Qwen reply had %s captions for %s images, captioning one by one",
+                           len(captions), len(image_paths))
+        except Exception as e:
+            logger.warning("⚠️ Batched Qwen captioning failed (%s), captioning one by one", e)
+        return await asyncio.gather(*[self.generate_image_caption_async(p) for p in image_paths])
+
+    async def caption_images_async(self, image_paths: List[str]) -> List[str]:
+        batches = [image_paths[i:i + CAPTION_BATCH_SIZE] for i in range(0, len(image_paths), CAPTION_BATCH_SIZE)]
+        results = await asyncio.gather(*[self.generate_image_captions_batch_async(b) for b in batches])
+        return [caption for batch in results for caption in batch]
+
+    def generate_image_captions_batch(self, image_paths: List[str]) -> List[str]:
+        """Caption several images in a single Qwen request; results are in input order."""
+        return run_async(self.generate_image_captions_batch_async(image_paths))
+
+    def caption_images(self, image_paths: List[str]) -> List[str]:
+        """Caption many images concurrently; results are in input order."""
+        return run_async(self.caption_images_async(image_paths))
+
+    def generate_image_caption(self, image_path: str) -> str:
+        """Use Qwen2.5-VL (via OpenRouter) to caption an image."""
+        return run_async(self.generate_image_caption_async(image_path))
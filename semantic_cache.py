@@ -0,0 +1,116 @@
+import atexit
+import json
+import logging
+import os
+import tempfile
+import threading
+from pathlib import Path
+from typing import Any, Optional
+import numpy as np
+from similarity import normalize_rows
+
+logger = logging.getLogger(__name__)
+
+
+class SemanticCache:
+    """LRU cache keyed by embeddings; a lookup hits when cosine similarity >= threshold."""
+
+    def __init__(self, dimension: int, threshold: float, capacity: int = 1024, path: Optional[Path] = None,
+                 save_interval: float = 30.0):
+        self.dimension = dimension
+        self.threshold = threshold
+        self.capacity = capacity
+        self.path = Path(path) if path else None
+        self._keys = np.zeros((capacity, dimension), dtype=np.float32)
+        self._values = [None] * capacity
+        self._last_used = np.zeros(capacity, dtype=np.int64)
+        self._size = 0
+        self._tick = 0
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()  # orders snapshots so an older one never overwrites a newer one
+        self.save_interval = save_interval
+        self._save_timer = None
+        if self.path:
+            self._load()
+            atexit.register(self.save)
+
+    @staticmethod
+    def _normalize(embedding) -> np.ndarray:
+        return normalize_rows(np.array(embedding, dtype=np.float32).reshape(1, -1))[0]
+
+    def lookup(self, embedding) -> Optional[Any]:
+        q = self._normalize(embedding)
+        with self._lock:
+            if self._size == 0:
+                return None
+            scores = self._keys[:self._size] @ q
+            best = int(np.argmax(scores))
+            if scores[best] < self.threshold:
+                return None
+            self._tick += 1
+            self._last_used[best] = self._tick
+            return self._values[best]
+
+    def insert(self, embedding, value: Any):
+        q = self._normalize(embedding)
+        with self._lock:
+            if self._size < self.capacity:
+                slot = self._size
+                self._size += 1
+            else:
+                slot = int(np.argmin(self._last_used))
+            self._tick += 1
+            self._keys[slot] = q
+            self._values[slot] = value
+            self._last_used[slot] = self._tick
+            # Debounced: one write per save_interval instead of a full rewrite on every query
+            if self.path and self._save_timer is None:
+                self._save_timer = threading.Timer(self.save_interval, self.save)
+                self._save_timer.daemon = True
+                self._save_timer.start()
+
+    def clear(self):
+        with self._lock:
+            self._values = [None] * self.capacity
+            self._last_used[:] = 0
+            self._size = 0
+
+    def save(self):
+        """Write keys and values as one .npz snapshot, replaced atomically"""
+        with self._save_lock:
+            with self._lock:
+                if self._save_timer is not None:
+                    self._save_timer.cancel()
+                    self._save_timer = None
+                keys = self._keys[:self._size].copy()
+                values = json.dumps(self._values[:self._size], ensure_ascii=False)
+            target = self.path.with_suffix(".npz")
+            target.parent.mkdir(parents=True, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=target.parent, suffix=".tmp")
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    np.savez(f, keys=keys, values=np.array(values))
+                os.replace(tmp_path, target)
+            except OSError as e:
+                Path(tmp_path).unlink(missing_ok=True)
+                logger.warning("⚠️ Could not save semantic cache %s: %s", target, e)
+
+    def _load(self):
+        target = self.path.with_suffix(".npz")
+        if not target.exists():
+            return
+        try:
+            with np.load(target) as data:
+                keys = data["keys"]
+                values = json.loads(str(data["values"]))
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning("⚠️ Ignoring unreadable semantic cache %s: %s", self.path, e)
+            return
+        if keys.ndim != 2 or keys.shape[1] != self.dimension or len(values) != len(keys):
+            return
+        keys, values = keys[-self.capacity:], values[-self.capacity:]
+        self._size = len(keys)
+        self._keys[:self._size] = keys
+        self._values[:self._size] = values
+        self._tick = self._size
+        self._last_used[:self._size] = np.arange(1, self._size + 1)
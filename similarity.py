@@ -0,0 +1,27 @@
+import numpy as np
+
+
+def cosine_similarities(vecs1, vecs2) -> np.ndarray:
+    """Row-wise cosine similarity between two (N, D) batches of vectors"""
+    a = np.asarray(vecs1, dtype=np.float32)
+    b = np.asarray(vecs2, dtype=np.float32)
+    uv = np.einsum('ij,ij->i', a, b)
+    uu = np.einsum('ij,ij->i', a, a)
+    vv = np.einsum('ij,ij->i', b, b)
+    return uv / np.sqrt(uu * vv + 1e-8)
+
+
+def normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    """L2-normalize the rows of a float32 (N, D) matrix in place; all-zero rows stay zero"""
+    norms = np.sqrt(np.einsum('ij,ij->i', matrix, matrix))[:, None]
+    np.divide(matrix, np.maximum(norms, 1e-12), out=matrix)
+    return matrix
+
+
+def aligned_empty(shape, dtype=np.float32, alignment: int = 64) -> np.ndarray:
+    """Uninitialized C-contiguous array whose data starts on an `alignment`-byte boundary"""
+    dtype = np.dtype(dtype)
+    nbytes = int(np.prod(shape)) * dtype.itemsize
+    buffer = np.empty(nbytes + alignment, dtype=np.uint8)
+    offset = -buffer.ctypes.data % alignment
+    return buffer[offset:offset + nbytes].view(dtype).reshape(shape)
@@ -1,7 +1,8 @@
 import streamlit as st
 import tempfile
 import os
-import json
+import orjson
+import shutil
 import re
 from pathlib import Path
 from evaluation import evaluate_document
@@ -10,6 +11,10 @@ from config import *
 from qwen_client import QwenClient
 from vector_store import VectorStore
 from pdf_processor import PDFProcessor
+from caption_cache import CachedCaptioner
+from query_decomposer import QueryDecomposer
+
+setup_logging()
 
 st.set_page_config(
     page_title="Multimodal PDF RAG System with Query Decomposition",
@@ -31,7 +36,7 @@ def main():
     initialize_session_state()
 
     st.title("📚 Multimodal PDF RAG System with Query Decomposition")
-    st.markdown("Upload PDFs and ask any question. The system **always decomposes** your queries into sub-questions to generate rich, context-aware answers from text, images, and tables.")
+    st.markdown("Upload PDFs and ask any question. The system **decomposes** multi-part queries into sub-questions to generate rich, context-aware answers from text, images, and tables, and answers simple lookups directly.")
 
     with st.sidebar:
         st.header("Upload PDFs")
@@ -57,7 +62,7 @@ def main():
         st.markdown("---")
         st.header("Query Handling Info")
         st.info(
-            "All queries are **automatically treated as complex** and broken down into sub-questions for improved retrieval and accuracy.\n\n"
+            "Long or multi-part queries are **automatically broken down** into sub-questions for improved retrieval and accuracy; simple lookups skip decomposition.\n\n"
             "Check the terminal/console for a detailed breakdown!"
         )
 
@@ -66,7 +71,7 @@ def main():
         evaluation_file = st.file_uploader(
             "Upload Evaluation JSON file",
             type="json",
-            help="Upload a JSON file containing 'question' and 'answer' pairs or lists."
+            help="Upload a JSON list of objects, each with a 'question' and a 'ground_truth_answer'."
         )
         if evaluation_file and st.button("Run Evaluation"):
             run_evaluation_mode(evaluation_file)
@@ -93,8 +98,11 @@ def main():
             total_chunks = chat_item.get('total_chunks_collected', 0)
             reranked_chunks = chat_item.get('reranked_chunks_used', 0)
 
-            with st.container():
-                st.markdown(f"**🔴 Q{i+1}:** {question}")
+            marker = "🟢" if chat_item.get('method') == 'simple' else "🔴"
+            with st.chat_message("user"):
+                st.markdown(f"**{marker} Q{i+1}:** {question}")
+
+            with st.chat_message("assistant"):
                 if sub_queries:
                     with st.expander("🧩 Sub-queries used"):
                         for j, sub_q in enumerate(sub_queries, 1):
@@ -109,10 +117,10 @@ def main():
                             caption = img.get("content", "")
                             page = img.get("page_number", "N/A")
                             if os.path.exists(image_path):
-                                st.image(image_path, caption=f"📄 Page {page}: {caption}", width=300)
+                                image_bytes = load_image_bytes(image_path, os.path.getmtime(image_path))
+                                st.image(image_bytes, caption=f"📄 Page {page}: {caption}", width=300)
 
                 st.caption(f"📊 Chunks collected: {total_chunks} | Final reranked chunks: {reranked_chunks}")
-                st.divider()
 
         question = st.text_input(
             "Ask a question about your documents:",
@@ -145,23 +153,49 @@ def main():
         for question in example_questions:
             st.markdown(f"• {question}")
 
+@st.cache_resource(show_spinner=False)
+def get_caption_model():
+    """Caption client and its cache, built once per server process"""
+    return CachedCaptioner(QwenClient())
+
+@st.cache_resource(show_spinner=False)
+def get_query_decomposer():
+    """Query decomposer, whose sentence-embedding model loads once instead of per upload"""
+    return QueryDecomposer()
+
+@st.cache_data(show_spinner=False)
+def load_image_bytes(image_path, mtime):
+    """Read an image once per (path, mtime) so reruns don't hit the disk for old turns"""
+    return Path(image_path).read_bytes()
+
 def process_pdfs(uploaded_files):
     with st.spinner("Processing PDFs..."):
         try:
             vector_store = VectorStore()
-            pdf_processor = PDFProcessor(vector_store)
+            pdf_processor = PDFProcessor(
+                vector_store,
+                caption_model=get_caption_model(),
+                query_decomposer=get_query_decomposer(),
+            )
 
             temp_paths = []
             for uploaded_file in uploaded_files:
                 with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as tmp_file:
-                    tmp_file.write(uploaded_file.getvalue())
+                    # Stream in 1 MiB chunks instead of materialising the whole upload with getvalue()
+                    uploaded_file.seek(0)
+                    shutil.copyfileobj(uploaded_file, tmp_file, 1 << 20)
                     temp_paths.append(tmp_file.name)
 
-            results = pdf_processor.process_multiple_pdfs(temp_paths)
-            pdf_processor.build_vector_index()
+            progress_bar = st.progress(0.0, text="Extracting PDFs...")
+
+            def update_progress(done, total):
+                progress_bar.progress(done / total, text=f"Processed {done}/{total} PDFs")
+
+            results = pdf_processor.process_and_index_pdfs(temp_paths, progress_callback=update_progress)
 
             st.session_state.pdf_processor = pdf_processor
             st.session_state.processed_files = []
+            failed_files = []
 
             for i, (file_name, result) in enumerate(results.items()):
                 if 'error' not in result:
@@ -169,6 +203,8 @@ def process_pdfs(uploaded_files):
                         'name': uploaded_files[i].name,
                         **result
                     })
+                else:
+                    failed_files.append(f"{uploaded_files[i].name} ({result['error']})")
 
             for temp_path in temp_paths:
                 try:
@@ -176,8 +212,12 @@ def process_pdfs(uploaded_files):
                 except:
                     pass
 
-            st.success(f"Successfully processed {len(uploaded_files)} PDF files!")
-            st.rerun()
+            if failed_files:
+                # No rerun, so the failure stays on screen
+                st.error("Failed to process: " + "; ".join(failed_files))
+            else:
+                st.success(f"Successfully processed {len(uploaded_files)} PDF files!")
+                st.rerun()
 
         except Exception as e:
             st.error(f"Error processing PDFs: {e}")
@@ -196,7 +236,7 @@ def ask_question(question, selected_model):
             chat_entry = {
                 'question': question,
                 'answer': answer,
-                'method': 'complex',
+                'method': result.get('method', 'complex'),
                 'sub_queries': result.get('sub_queries', []),
                 'total_chunks_collected': result.get('total_chunks_collected', 0),
                 'reranked_chunks_used': result.get('reranked_chunks_used', 0),
@@ -211,8 +251,19 @@ def ask_question(question, selected_model):
 
 def run_evaluation_mode(evaluation_file):
     if st.session_state.pdf_processor:
-        document_name = "transformer_comparison"
-        results = evaluate_document(document_name, st.session_state.pdf_processor)
+        document_name = Path(evaluation_file.name).stem
+        try:
+            gt_data = orjson.loads(evaluation_file.getvalue())
+        except orjson.JSONDecodeError as e:
+            st.error(f"Evaluation file is not valid JSON: {e}")
+            return
+        if not isinstance(gt_data, list) or not all(isinstance(qa, dict) for qa in gt_data):
+            st.error("Evaluation file must be a JSON list of objects with 'question' and 'ground_truth_answer'.")
+            return
+        results = evaluate_document(document_name, st.session_state.pdf_processor, gt_data=gt_data)
+        if not results:
+            st.warning("No entries with both 'question' and 'ground_truth_answer' to evaluate.")
+            return
 
         for i, res in enumerate(results):
             st.markdown(f"**Q{i+1}:** {res['question']}")
@@ -0,0 +1,107 @@
+import hashlib
+
+import numpy as np
+import pytest
+
+pytest.importorskip("faiss")
+pytest.importorskip("google.generativeai")
+
+import vector_store
+from vector_store import VectorStore
+
+
+def _fake_embeddings(self, texts):
+    """Deterministic unit vectors per text, standing in for the embedding API"""
+    rows = np.stack([
+        np.random.default_rng(int(hashlib.sha256(text.encode()).hexdigest()[:8], 16))
+        .standard_normal(self.dimension)
+        for text in texts
+    ]).astype(np.float32)
+    rows /= np.linalg.norm(rows, axis=1, keepdims=True)
+    return rows, list(range(len(texts)))
+
+
+def _chunks(start, stop):
+    return [{'content': f"chunk {i}", 'type': 'text', 'page_number': i + 1, 'doc_name': 'doc',
+             'metadata': {'source': 'test'}}
+            for i in range(start, stop)]
+
+
+@pytest.fixture
+def make_store(tmp_path, monkeypatch):
+    monkeypatch.setattr(vector_store, "VECTORS_DIR", tmp_path)
+    monkeypatch.setattr(vector_store, "EmbeddingCache", lambda: None)
+    monkeypatch.setattr(VectorStore, "create_embeddings", _fake_embeddings)
+    return lambda: VectorStore(api_key="test")
+
+
+def test_load_add_save_under_one_filename(make_store):
+    store = make_store()
+    store.build_index(_chunks(0, 100))
+    store.save_index("same")
+
+    reloaded = make_store()
+    assert reloaded.load_index("same")
+    reloaded.add_chunks(_chunks(100, 150))
+    reloaded.save_index("same")
+
+    final = make_store()
+    assert final.load_index("same")
+    assert final.index.ntotal == 150
+    assert len(final.chunks) == 150
+    assert final.chunks[120]['content'] == "chunk 120"
+    np.testing.assert_allclose(final.embeddings, _fake_embeddings(final, [f"chunk {i}" for i in range(150)])[0])
+
+
+def test_save_right_after_load_keeps_mapped_files_intact(make_store):
+    store = make_store()
+    store.build_index(_chunks(0, 100))
+    store.save_index("same")
+
+    reloaded = make_store()
+    assert reloaded.load_index("same")
+    reloaded.save_index("same")  # embeddings and chunks are still mmap views of these files
+
+    final = make_store()
+    assert final.load_index("same")
+    assert [chunk['content'] for chunk in final.chunks] == [f"chunk {i}" for i in range(100)]
+    np.testing.assert_allclose(final.embeddings, reloaded.embeddings)
+
+
+def test_recall_after_mid_stream_partitioning(make_store, monkeypatch):
+    monkeypatch.setattr(vector_store, "BRUTE_FORCE_MAX_CHUNKS", 256)
+    monkeypatch.setattr(vector_store, "IVF_MIN_CHUNKS", 2000)
+    store = make_store()
+    for start in range(0, 3000, 64):  # the indexer's micro-batches; conversion happens mid-stream
+        store.add_chunks(_chunks(start, min(start + 64, 3000)))
+    assert isinstance(store.index, vector_store.faiss.IndexIVF)
+
+    # Vectors added after the IVF-SQ8 ranges were trained must be found as reliably as the training set
+    vectors = _fake_embeddings(store, [f"chunk {i}" for i in range(3000)])[0]
+    rng = np.random.default_rng(0)
+
+    def recall(sources):
+        queries = vectors[sources] + rng.normal(scale=0.02, size=(len(sources), store.dimension)).astype(np.float32)
+        queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+        _, found = store.index.search(queries, 5)
+        return np.mean([source in row for source, row in zip(sources, found)])
+
+    trained, added_later = recall(np.arange(0, 200)), recall(np.arange(2800, 3000))
+    assert trained >= 0.9
+    assert added_later >= trained - 0.05
+
+
+def test_query_cache_is_keyed_by_nprobe(make_store, monkeypatch):
+    store = make_store()
+    store.build_index(_chunks(0, 10))
+    monkeypatch.setattr(store, "create_query_embedding", lambda query: _fake_embeddings(store, ["chunk 3"])[0])
+    calls = []
+    search_index = store._search_index
+    monkeypatch.setattr(store, "_search_index", lambda *args: calls.append(args[2]) or search_index(*args))
+
+    store.search("q", top_k=3, nprobe=4)
+    store.search("q", top_k=3, nprobe=4)
+    store.search("q", top_k=3, nprobe=32)
+    store.search("q", top_k=3, nprobe=32)
+    store.search("q", top_k=3, nprobe=4)
+    assert calls == [4, 32]
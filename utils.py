@@ -1,45 +1,76 @@
 import fitz  # PyMuPDF
 import pdfplumber
 import pickle
-import json
+import orjson
+import multiprocessing
 import os
-from pdf2image import convert_from_path
-from typing import List, Dict, Any, Tuple
+import re
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from itertools import chain, repeat
+from typing import List, Dict, Any, Optional, Tuple
 from PIL import Image
-import pandas as pd
 from pathlib import Path
-from config import CHUNK_SIZE, METADATA_DIR,IMAGES_DIR
+import msgpack
+import zstandard as zstd
+from config import CHUNK_SIZE, METADATA_DIR,IMAGES_DIR, PDF_PAGE_BLOCK_SIZE, IMAGE_WRITE_WORKERS
 
-def extract_text_from_pdf(pdf_path: str) -> List[Dict[str, Any]]:
-    """Extract text from PDF using PyMuPDF"""
-    doc = fitz.open(pdf_path)
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # pyarrow is optional; metadata falls back to msgpack
+    pa = pq = None
+
+_WORD_RE = re.compile(r'\S+')
+
+def _iter_text_chunks(text: str):
+    """Yield (chunk_text, word_count) by slicing between word offsets, without re-joining words"""
+    spans = [m.span() for m in _WORD_RE.finditer(text)]
+    for i in range(0, len(spans), CHUNK_SIZE):
+        last = min(i + CHUNK_SIZE, len(spans)) - 1
+        yield text[spans[i][0]:spans[last][1]], last - i + 1
+
+def _extract_page_text(page, page_num: int, doc_name: str, textpage=None) -> List[Dict[str, Any]]:
+    text = page.get_text(textpage=textpage)
+    base = {'type': 'text', 'page_number': page_num + 1, 'doc_name': doc_name}
+    return [
+        {**base, 'content': chunk, 'metadata': {'word_count': word_count, 'char_count': len(chunk)}}
+        for chunk, word_count in _iter_text_chunks(text)
+    ]
+
+def page_blocks(pdf_path: str) -> List[range]:
+    """Split a PDF's pages into blocks that worker processes extract independently"""
+    with fitz.open(pdf_path) as doc:
+        page_count = len(doc)
+    return [range(start, min(start + PDF_PAGE_BLOCK_SIZE, page_count))
+            for start in range(0, page_count, PDF_PAGE_BLOCK_SIZE)]
+
+# Workers must not be forked from a process running gRPC, asyncio-loop and log-listener threads
+POOL_CONTEXT = multiprocessing.get_context(
+    "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+)
+
+def _map_page_blocks(block_fn, pdf_path: str) -> List[Any]:
+    """Run block_fn over each page block, in worker processes when there is more than one"""
+    blocks = page_blocks(pdf_path)
+    if len(blocks) <= 1:
+        return [block_fn(pdf_path, block) for block in blocks]
+    # Each worker reopens the PDF; parser handles can't be shared across processes
+    max_workers = min(os.cpu_count() or 1, len(blocks))
+    with ProcessPoolExecutor(max_workers=max_workers, mp_context=POOL_CONTEXT) as executor:
+        return list(executor.map(block_fn, repeat(pdf_path), blocks))
+
+def _extract_text_block(pdf_path: str, page_nums: range) -> List[Dict[str, Any]]:
     text_chunks = []
-    
-    for page_num in range(len(doc)):
-        page = doc.load_page(page_num)
-        text = page.get_text()
-        
-        if text.strip():
-            # Split text into chunks
-            words = text.split()
-            for i in range(0, len(words), CHUNK_SIZE):
-                chunk_words = words[i:i + CHUNK_SIZE]
-                chunk_text = " ".join(chunk_words)
-                
-                text_chunks.append({
-                    'content': chunk_text,
-                    'type': 'text',
-                    'page_number': page_num + 1,
-                    'doc_name': Path(pdf_path).stem,
-                    'metadata': {
-                        'word_count': len(chunk_words),
-                        'char_count': len(chunk_text)
-                    }
-                })
-    
-    doc.close()
+    doc_name = Path(pdf_path).stem
+    with fitz.open(pdf_path) as doc:
+        for page_num in page_nums:
+            text_chunks.extend(_extract_page_text(doc.load_page(page_num), page_num, doc_name))
     return text_chunks
 
+def extract_text_from_pdf(pdf_path: str) -> List[Dict[str, Any]]:
+    """Extract text from PDF using PyMuPDF"""
+    return list(chain.from_iterable(_map_page_blocks(_extract_text_block, pdf_path)))
+
 # def extract_images_from_pdf(pdf_path: str) -> List[Dict[str, Any]]:
 #     """Extract images and render full pages to capture diagrams in PDFs."""
 #     doc = fitz.open(pdf_path)
@@ -90,100 +121,223 @@ def extract_text_from_pdf(pdf_path: str) -> List[Dict[str, Any]]:
 #     doc.close()
 #     return image_chunks
 
-def extract_images_from_pdf(pdf_path: str) -> List[Dict[str, Any]]:
-    """Extract images from PDF using PyMuPDF, along with heading metadata."""
-    doc = fitz.open(pdf_path)
+_PIXMAP_MODES = {(1, 0): "L", (2, 1): "LA", (3, 0): "RGB", (4, 1): "RGBA"}
+_NATIVE_IMAGE_EXTS = {"png", "jpg", "jpeg"}  # stored formats the captioning models accept as-is
+
+def _write_image(job: Tuple[Path, Any]):
+    img_path, data = job
+    if isinstance(data, bytes):
+        img_path.write_bytes(data)
+    else:
+        data.save(str(img_path), "PNG")
+
+def _write_images(jobs: List[Tuple[Path, Any]]):
+    """Write extracted images on threads; Pillow releases the GIL while compressing"""
+    if len(jobs) <= 1:
+        for job in jobs:
+            _write_image(job)
+        return
+    with ThreadPoolExecutor(max_workers=min(IMAGE_WRITE_WORKERS, len(jobs))) as executor:
+        list(executor.map(_write_image, jobs))
+
+def _decode_image(doc, xref: int, base_path: str) -> Optional[Tuple[Path, Any, int, int]]:
+    """Image (path, bytes or Pillow image, width, height), or None for colorspaces we skip"""
+    # Prefer the encoded stream stored in the PDF: no decode, no PNG re-encode
+    info = doc.extract_image(xref)
+    if info and info.get("ext") in _NATIVE_IMAGE_EXTS and info.get("colorspace") in (1, 3):
+        return Path(f"{base_path}.{info['ext']}"), info["image"], info["width"], info["height"]
+
+    # Fallback for PDF-specific encodings (JPX, JBIG2, indexed, ...): decode via MuPDF
+    pix = fitz.Pixmap(doc, xref)
+    if pix.n - pix.alpha >= 4:  # CMYK and other non GRAY/RGB colorspaces
+        return None
+    # Decoding stays here (MuPDF isn't thread-safe); encoding and the write are deferred
+    mode = _PIXMAP_MODES.get((pix.n, pix.alpha))
+    image = Image.frombytes(mode, (pix.width, pix.height), pix.samples) if mode else pix.tobytes("png")
+    return Path(f"{base_path}.png"), image, pix.width, pix.height
+
+def _extract_page_images(doc, page, page_num: int, doc_name: str, textpage=None,
+                         write_jobs: List[Tuple[Path, Any]] = None) -> List[Dict[str, Any]]:
     image_chunks = []
+    images = page.get_images(full=True)
+    if not images:
+        return image_chunks
+
+    # --- Extract first heading or nearby text, once per page ---
+    blocks = page.get_text("dict", textpage=textpage)["blocks"]
+    heading = next(
+        (block["lines"][0]["spans"][0]["text"] for block in blocks
+         if block["type"] == 0 and block.get("lines") and block["lines"][0].get("spans")),  # text block
+        ""
+    )
+
+    path_prefix = f"{IMAGES_DIR}{os.sep}{doc_name}_page_{page_num + 1}_img_"
+    for img_index, img in enumerate(images):
+        xref = img[0]
+        decoded = _decode_image(doc, xref, f"{path_prefix}{img_index}")
+        if decoded is None:
+            continue
+        img_path, data, width, height = decoded
+        if write_jobs is None:
+            _write_image((img_path, data))
+        else:
+            write_jobs.append((img_path, data))
+        
+        image_chunks.append({
+            'content': '',  # Will be filled by image captioning
+            'type': 'image',
+            'page_number': page_num + 1,
+            'doc_name': doc_name,
+            'image_path': str(img_path),
+            'metadata': {
+                'width': width,
+                'height': height,
+                'image_index': img_index,
+                'heading': heading
+            }
+        })
+    
+    return image_chunks
+
+def _extract_images_block(pdf_path: str, page_nums: range) -> List[Dict[str, Any]]:
+    image_chunks, write_jobs = [], []
     doc_name = Path(pdf_path).stem
+    with fitz.open(pdf_path) as doc:
+        for page_num in page_nums:
+            image_chunks.extend(_extract_page_images(doc, doc.load_page(page_num), page_num, doc_name,
+                                                     write_jobs=write_jobs))
+    _write_images(write_jobs)
+    return image_chunks
+
+def extract_images_from_pdf(pdf_path: str) -> List[Dict[str, Any]]:
+    """Extract images from PDF using PyMuPDF, along with heading metadata."""
+    return list(chain.from_iterable(_map_page_blocks(_extract_images_block, pdf_path)))
+
+
+def _markdown_cell(value) -> str:
+    return "" if value is None else str(value).replace("\n", " ").replace("|", "\\|")
+
+def _table_to_markdown(header: List[Any], rows: List[List[Any]]) -> str:
+    lines = ["| " + " | ".join(_markdown_cell(h) for h in header) + " |",
+             "|" + "|".join(":---" for _ in header) + "|"]
+    lines.extend("| " + " | ".join(_markdown_cell(cell) for cell in row) + " |" for row in rows)
+    return "\n".join(lines)
+
+def _extract_page_tables(page, page_num: int, doc_name: str) -> List[Dict[str, Any]]:
+    table_chunks = []
+    tables = page.extract_tables()
     
-    for page_num, page in enumerate(doc):
-        images = page.get_images(full=True)
-        for img_index, img in enumerate(images):
-            xref = img[0]
-            pix = fitz.Pixmap(doc, xref)
+    for table_index, table in enumerate(tables):
+        if table and len(table) > 1:  # Ensure table has header and data
+            # Remove duplicate columns, keeping the first occurrence of each header
+            seen = set()
+            keep = [i for i, name in enumerate(table[0]) if not (name in seen or seen.add(name))]
+            header = [table[0][i] for i in keep]
+            rows = [[row[i] if i < len(row) else None for i in keep] for row in table[1:]]
             
-            if pix.n - pix.alpha < 4:  # GRAY or RGB
-                img_path = IMAGES_DIR / f"{doc_name}_page_{page_num + 1}_img_{img_index}.png"
-                pix.save(str(img_path))
-                
-                # --- Extract first heading or nearby text ---
-                heading = ""
-                blocks = page.get_text("dict")["blocks"]
-                for block in blocks:
-                    if block["type"] == 0:  # text block
-                        heading = block["lines"][0]["spans"][0]["text"]
-                        break
-                
-                image_chunks.append({
-                    'content': '',  # Will be filled by image captioning
-                    'type': 'image',
-                    'page_number': page_num + 1,
-                    'doc_name': doc_name,
-                    'image_path': str(img_path),
-                    'metadata': {
-                        'width': pix.width,
-                        'height': pix.height,
-                        'image_index': img_index,
-                        'heading': heading
-                    }
-                })
+            # Serialize directly; a DataFrame round-trip per table costs more than the walk itself
+            markdown_table = _table_to_markdown(header, rows)
+            table_json = orjson.dumps([dict(zip(header, row)) for row in rows],
+                                      option=orjson.OPT_NON_STR_KEYS).decode()
             
-            pix = None
+            table_chunks.append({
+                'content': markdown_table,
+                'type': 'table',
+                'page_number': page_num + 1,
+                'doc_name': doc_name,
+                'table_json': table_json,
+                'metadata': {
+                    'rows': len(rows),
+                    'columns': len(header),
+                    'table_index': table_index,
+                    'column_names': header
+                }
+            })
     
-    doc.close()
-    return image_chunks
+    return table_chunks
 
+def _extract_tables_block(pdf_path: str, page_nums: range) -> List[Dict[str, Any]]:
+    table_chunks = []
+    doc_name = Path(pdf_path).stem
+    with pdfplumber.open(pdf_path) as pdf:
+        for page_num in page_nums:
+            table_chunks.extend(_extract_page_tables(pdf.pages[page_num], page_num, doc_name))
+    return table_chunks
 
 def extract_tables_from_pdf(pdf_path: str) -> List[Dict[str, Any]]:
     """Extract tables from PDF using pdfplumber"""
-    table_chunks = []
+    return list(chain.from_iterable(_map_page_blocks(_extract_tables_block, pdf_path)))
+
+
+def extract_page_block(pdf_path: str, page_nums: range) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]], List[Dict[str, Any]]]:
+    """Extract text, images and tables from a block of pages, opening the PDF once per parser"""
+    text_chunks, image_chunks, table_chunks = [], [], []
+    write_jobs = []
     doc_name = Path(pdf_path).stem
     
-    with pdfplumber.open(pdf_path) as pdf:
-        for page_num, page in enumerate(pdf.pages):
-            tables = page.extract_tables()
-            
-            for table_index, table in enumerate(tables):
-                if table and len(table) > 1:  # Ensure table has header and data
-                    # Convert table to DataFrame
-                    df = pd.DataFrame(table[1:], columns=table[0])
-
-                    # Remove duplicate columns (fix!)
-                    df = df.loc[:, ~df.columns.duplicated()]
-                    
-                    # Convert to markdown
-                    markdown_table = df.to_markdown(index=False)
-                    
-                    # Convert to JSON
-                    table_json = df.to_json(orient='records')
-                    
-                    table_chunks.append({
-                        'content': markdown_table,
-                        'type': 'table',
-                        'page_number': page_num + 1,
-                        'doc_name': doc_name,
-                        'table_json': table_json,
-                        'metadata': {
-                            'rows': len(df),
-                            'columns': len(df.columns),
-                            'table_index': table_index,
-                            'column_names': list(df.columns)
-                        }
-                    })
+    with fitz.open(pdf_path) as doc, pdfplumber.open(pdf_path) as pdf:
+        for page_num in page_nums:
+            page = doc.load_page(page_num)
+            # Parse the page's text layer once and share it between plain text and heading lookup;
+            # get_text ignores its flags when given a textpage, so pass get_text()'s defaults here
+            textpage = page.get_textpage(flags=fitz.TEXTFLAGS_TEXT)
+            text_chunks.extend(_extract_page_text(page, page_num, doc_name, textpage))
+            image_chunks.extend(_extract_page_images(doc, page, page_num, doc_name, textpage, write_jobs))
+            table_chunks.extend(_extract_page_tables(pdf.pages[page_num], page_num, doc_name))
     
-    return table_chunks
+    _write_images(write_jobs)
+    return text_chunks, image_chunks, table_chunks
+
+def merge_page_blocks(parts: List[Tuple[List, List, List]]) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]], List[Dict[str, Any]]]:
+    """Concatenate per-block (text, images, tables) results, preserving page order"""
+    return tuple(list(chain.from_iterable(kind)) for kind in zip(*parts)) if parts else ([], [], [])
+
+def extract_all_from_pdf(pdf_path: str) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]], List[Dict[str, Any]]]:
+    """Extract text, images and tables, spreading page blocks over worker processes"""
+    return merge_page_blocks(_map_page_blocks(extract_page_block, pdf_path))
+
 
+_METADATA_COLUMNS = ('doc_name', 'page_number', 'type', 'content', 'image_path', 'table_json')
+
+def chunks_to_table(chunks: List[Dict[str, Any]]):
+    """Columnar Arrow table of chunks; nested metadata and extra keys are stored as JSON"""
+    columns = {name: [chunk.get(name) for chunk in chunks] for name in _METADATA_COLUMNS}
+    columns['metadata_json'] = [orjson.dumps(chunk.get('metadata', {}), option=orjson.OPT_NON_STR_KEYS).decode()
+                                for chunk in chunks]
+    # Anything outside the fixed schema rides along so the round trip is lossless
+    columns['extra_json'] = [
+        orjson.dumps({k: v for k, v in chunk.items() if k not in _METADATA_COLUMNS and k != 'metadata'}).decode()
+        for chunk in chunks
+    ]
+    return pa.table(columns)
+
+def table_to_chunks(table) -> List[Dict[str, Any]]:
+    chunks = []
+    for row in table.to_pylist():
+        chunk = {name: row[name] for name in _METADATA_COLUMNS if row[name] is not None}
+        chunk['metadata'] = orjson.loads(row['metadata_json'])
+        chunk.update(orjson.loads(row['extra_json']))
+        chunks.append(chunk)
+    return chunks
 
 def save_metadata(chunks: List[Dict[str, Any]], filename: str):
-    """Save metadata to pickle file"""
-    metadata_path = METADATA_DIR / f"{filename}_metadata.pkl"
-    with open(metadata_path, 'wb') as f:
-        pickle.dump(chunks, f)
+    """Save metadata to a zstd-compressed Parquet file, or msgpack+zstd without pyarrow"""
+    if pq is None:
+        packed = msgpack.packb(chunks, use_bin_type=True)
+        (METADATA_DIR / f"{filename}_metadata.msgpack.zst").write_bytes(zstd.ZstdCompressor(level=3).compress(packed))
+        return
+    pq.write_table(chunks_to_table(chunks), METADATA_DIR / f"{filename}_metadata.parquet", compression='zstd')
 
 def load_metadata(filename: str) -> List[Dict[str, Any]]:
-    """Load metadata from pickle file"""
+    """Load metadata from Parquet or msgpack, falling back to legacy pickle files"""
+    parquet_path = METADATA_DIR / f"{filename}_metadata.parquet"
+    if pq is not None and parquet_path.exists():
+        return table_to_chunks(pq.read_table(parquet_path, memory_map=True))
+    msgpack_path = METADATA_DIR / f"{filename}_metadata.msgpack.zst"
+    if msgpack_path.exists():
+        return msgpack.unpackb(zstd.ZstdDecompressor().decompress(msgpack_path.read_bytes()), raw=False)
     metadata_path = METADATA_DIR / f"{filename}_metadata.pkl"
     if metadata_path.exists():
         with open(metadata_path, 'rb') as f:
             return pickle.load(f)
-    return []
\ No newline at end of file
+    return []
@@ -1,110 +1,485 @@
+import asyncio
+import logging
+import math
+import os
+import tempfile
+import time
 import faiss
 import numpy as np
 import google.generativeai as genai
-from typing import List, Dict, Any, Tuple
+from google.api_core import exceptions as google_exceptions
+from gemini_client import configure_gemini
+from collections.abc import Mapping, Sequence
+from pathlib import Path
+from typing import Callable, List, Dict, Any, Tuple
 import pickle
-from config import GOOGLE_API_KEY, EMBEDDING_MODEL, VECTORS_DIR
+from config import (
+    GOOGLE_API_KEY,
+    EMBEDDING_MODEL,
+    VECTORS_DIR,
+    BRUTE_FORCE_MAX_CHUNKS,
+    GPU_MIN_CHUNKS,
+    VECTOR_INDEX_TYPE,
+    IVF_MIN_CHUNKS,
+    IVF_NPROBE,
+    SQ8_RANGE_MARGIN,
+    HNSW_M,
+    HNSW_EF_CONSTRUCTION,
+    HNSW_EF_SEARCH,
+    INDEX_ADD_BATCH_SIZE,
+    EMBEDDING_BATCH_SIZE,
+    EMBEDDING_MAX_CONCURRENCY,
+    EMBEDDING_MAX_RETRIES,
+    EMBEDDING_RETRY_ROUNDS,
+    QUERY_CACHE_SIZE,
+    QUERY_CACHE_THRESHOLD,
+)
+from embedding_cache import EmbeddingCache
+from similarity import aligned_empty, normalize_rows
+from utils import chunks_to_table, table_to_chunks
+
+try:
+    import pyarrow.feather as feather
+except ImportError:  # pyarrow is optional; chunks fall back to pickle
+    feather = None
+from semantic_cache import SemanticCache
+from async_runner import run_async
+
+logger = logging.getLogger(__name__)
+
+_RETRYABLE_ERRORS = (
+    google_exceptions.TooManyRequests,
+    google_exceptions.ResourceExhausted,
+    google_exceptions.InternalServerError,
+    google_exceptions.ServiceUnavailable,
+    google_exceptions.DeadlineExceeded,
+)
+
+def _write_atomically(path: Path, write: Callable[[str], None]):
+    """Write through a temp file renamed over path, so a memory-mapped reader of path is never clobbered"""
+    # Keep the real extension last, since np.save appends ".npy" to names without it
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, suffix=".tmp" + path.suffix)
+    os.close(fd)
+    try:
+        write(tmp_path)
+        os.replace(tmp_path, path)
+    except BaseException:
+        Path(tmp_path).unlink(missing_ok=True)
+        raise
+
+def _top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    """Indices of the k highest scores, best first, without sorting the whole array"""
+    if k < len(scores):
+        candidates = np.argpartition(-scores, k - 1)[:k]
+    else:
+        candidates = np.arange(len(scores))
+    return candidates[np.argsort(-scores[candidates])]
+
+
+class _LazyChunks(Sequence):
+    """Chunks backed by an Arrow table; a row becomes a dict only when it is first accessed"""
+
+    def __init__(self, table):
+        self.table = table
+        self._rows = {}
+
+    def __len__(self) -> int:
+        return self.table.num_rows
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        return self.take([i])[0]
+
+    def take(self, indices: List[int]) -> List[Dict[str, Any]]:
+        """Rows at several positions, decoding the ones not seen before with a single Arrow take"""
+        new = [i for i in dict.fromkeys(indices) if i not in self._rows]
+        if new:
+            self._rows.update(zip(new, table_to_chunks(self.table.take(new))))
+        return [self._rows[i] for i in indices]
+
+
+class SearchResult(Mapping):
+    """Read-only view of a stored chunk plus its score, so search never copies the chunk dict"""
+
+    __slots__ = ('chunk', 'score')
+
+    def __init__(self, chunk: Dict[str, Any], score: float):
+        self.chunk = chunk
+        self.score = score
+
+    def __getitem__(self, key):
+        if key == 'similarity_score':
+            return self.score
+        return self.chunk[key]
+
+    def __iter__(self):
+        yield from self.chunk
+        yield 'similarity_score'
+
+    def __len__(self) -> int:
+        return len(self.chunk) + 1
+
 
 class VectorStore:
     def __init__(self, api_key: str = None):
-        genai.configure(api_key=api_key or GOOGLE_API_KEY)
+        configure_gemini(api_key or GOOGLE_API_KEY)
         self.index = None
         self.chunks = []
+        self.embeddings = None  # kept for small corpora, searched without FAISS
+        self.embedding_cache = EmbeddingCache()
         self.dimension = 768  # Gemini embedding dimension
+        self._gpu_resources = None  # created once; StandardGpuResources is expensive to build
+        self._ivf_quantizer = None
+        self._mapped_index_path = None  # set while self.index is a read-only mmap of this file
+        self._on_gpu = False
+        # Rephrased queries land near each other; reuse their hits instead of searching again
+        self.query_cache = SemanticCache(self.dimension, QUERY_CACHE_THRESHOLD, QUERY_CACHE_SIZE)
+
+    def create_embeddings(self, texts: List[str]) -> Tuple[np.ndarray, List[int]]:
+        """Unit-length embeddings of the texts that could be embedded, and their positions in texts"""
+        # Repeated headers/boilerplate are embedded once; remap points each text at its unique row
+        unique_rows = {}
+        remap = np.fromiter((unique_rows.setdefault(text, len(unique_rows)) for text in texts),
+                            dtype=np.intp, count=len(texts))
+        texts = list(unique_rows)
+        cached = self.embedding_cache.get_many(EMBEDDING_MODEL, texts, "retrieval_document")
+        embeddings = np.empty((len(texts), self.dimension), dtype=np.float32)
+        embedded = np.zeros(len(texts), dtype=bool)
+        missing = []
+        for i, embedding in enumerate(cached):
+            if embedding is None:
+                missing.append(i)
+            else:
+                embeddings[i] = embedding
+                embedded[i] = True
 
-    def create_embeddings(self, texts: List[str]) -> np.ndarray:
-        embeddings = []
+        # Texts that still fail go back on the queue for another round after a backoff pause
+        for round_ in range(EMBEDDING_RETRY_ROUNDS + 1):
+            if not missing:
+                break
+            if round_:
+                logger.warning("⚠️ Retrying %s failed embeddings in %ss", len(missing), 2 ** round_)
+                time.sleep(2 ** round_)
+            missing = self._embed_missing(texts, missing, embeddings, embedded)
 
-        for text in texts:
+        if missing:
+            logger.error("❌ Dropping %s texts that could not be embedded", len(missing))
+        if len(texts) < len(remap):
+            logger.debug("Embedded %s unique texts for %s chunks", len(texts), len(remap))
+        kept = np.flatnonzero(embedded[remap])
+        # 64-byte aligned rows let BLAS/FAISS use full-width vector loads without peeling
+        rows = np.take(embeddings, remap[kept], axis=0,
+                       out=aligned_empty((len(kept), self.dimension), np.float32))
+        return normalize_rows(rows), kept.tolist()
+
+    def _embed_missing(self, texts: List[str], missing: List[int],
+                       embeddings: np.ndarray, embedded: np.ndarray) -> List[int]:
+        """Embed texts[missing] into their rows and return the positions that still failed"""
+        # One request per EMBEDDING_BATCH_SIZE texts instead of one per chunk, several in flight
+        batches = [missing[start:start + EMBEDDING_BATCH_SIZE]
+                   for start in range(0, len(missing), EMBEDDING_BATCH_SIZE)]
+        batch_results = run_async(self._embed_batches([[texts[i] for i in batch] for batch in batches]))
+
+        failed = []
+        for batch, batch_embeddings in zip(batches, batch_results):
+            new_texts, new_embeddings = [], []
+            for i, embedding in zip(batch, batch_embeddings):
+                if embedding is None:
+                    failed.append(i)
+                    continue
+                embeddings[i] = embedding
+                embedded[i] = True
+                new_texts.append(texts[i])
+                new_embeddings.append(embedding)
+            self.embedding_cache.put_many(EMBEDDING_MODEL, new_texts, new_embeddings, "retrieval_document")
+        return failed
+
+    async def _embed_batches(self, batches: List[List[str]]) -> List[List[Any]]:
+        semaphore = asyncio.Semaphore(EMBEDDING_MAX_CONCURRENCY)
+        return await asyncio.gather(*[self._embed_batch(semaphore, batch) for batch in batches])
+
+    async def _embed_batch(self, semaphore: asyncio.Semaphore, texts: List[str]) -> List[Any]:
+        """Embeddings for one batch in input order; None marks texts that could not be embedded"""
+        try:
+            return await self._embed_documents(semaphore, texts)
+        except Exception as e:
+            logger.warning("⚠️ Batch embedding failed (%s), retrying %s texts one by one", e, len(texts))
+        return list(await asyncio.gather(*[self._embed_document_or_none(semaphore, text) for text in texts]))
+
+    @staticmethod
+    async def _embed_documents(semaphore: asyncio.Semaphore, texts: List[str]) -> List[List[float]]:
+        """embed_content with exponential backoff on rate limiting and transient server errors"""
+        for attempt in range(EMBEDDING_MAX_RETRIES + 1):
             try:
-                result = genai.embed_content(
-                    model=EMBEDDING_MODEL,
-                    content=text,
-                    task_type="retrieval_document",
-                    title="PDF Content"
-                )
-                embeddings.append(result['embedding'])
-            except Exception as e:
-                print(f"Error creating embedding for text: {e}")
-                embeddings.append([0.0] * self.dimension)
-
-        return np.array(embeddings, dtype=np.float32)
+                async with semaphore:
+                    result = await genai.embed_content_async(
+                        model=EMBEDDING_MODEL,
+                        content=texts,
+                        task_type="retrieval_document",
+                        title="PDF Content"
+                    )
+                return result['embedding']
+            except _RETRYABLE_ERRORS as e:
+                if attempt == EMBEDDING_MAX_RETRIES:
+                    raise
+                logger.warning("⚠️ Embedding request failed (%s), retrying in %ss", e, 2 ** attempt)
+                await asyncio.sleep(2 ** attempt)
+
+    async def _embed_document_or_none(self, semaphore: asyncio.Semaphore, text: str):
+        try:
+            return (await self._embed_documents(semaphore, [text]))[0]
+        except Exception as e:
+            logger.error("Error creating embedding for text: %s", e)
+            return None
 
     def create_query_embedding(self, query: str) -> np.ndarray:
+        """Unit-length (1, dimension) query embedding"""
+        cached = self.embedding_cache.get(EMBEDDING_MODEL, query, "retrieval_query")
+        if cached is not None:
+            return normalize_rows(cached.reshape(1, -1))
         try:
             result = genai.embed_content(
                 model=EMBEDDING_MODEL,
                 content=query,
                 task_type="retrieval_query"
             )
-            return np.array([result['embedding']], dtype=np.float32)
+            self.embedding_cache.put(EMBEDDING_MODEL, query, result['embedding'], "retrieval_query")
+            return normalize_rows(np.array([result['embedding']], dtype=np.float32))
         except Exception as e:
-            print(f"Error creating query embedding: {e}")
+            logger.error("Error creating query embedding: %s", e)
             return np.array([[0.0] * self.dimension], dtype=np.float32)
 
+    def reset(self):
+        self.index = None
+        self._mapped_index_path = None
+        self._on_gpu = False
+        self.chunks = []
+        self.embeddings = None
+        self.query_cache.clear()
+
     def build_index(self, chunks: List[Dict[str, Any]]):
         """Build FAISS index from non-empty chunks, log skipped ones."""
-        filtered_chunks = []
-        valid_texts = []
-
-        for chunk in chunks:
-            content = chunk.get("content", "").strip()
-            if not content:
-                doc = chunk.get("doc_name", "UnknownDoc")
-                page = chunk.get("page_number", "N/A")
-                ctype = chunk.get("type", "unknown")
-                print(f"⚠️ Skipping empty chunk | Type: {ctype} | Page: {page} | Doc: {doc}")
-                continue
-            filtered_chunks.append(chunk)
-            valid_texts.append(content)
-
-        if not valid_texts:
-            print("⚠️ No valid content found for indexing.")
+        self.reset()
+        self.add_chunks(chunks)
+
+        if self.index is None:
+            logger.warning("⚠️ No valid content found for indexing.")
             return
 
-        embeddings = self.create_embeddings(valid_texts)
+        logger.info("✅ Built index with %s valid chunks", len(self.chunks))
+
+    def add_chunks(self, chunks: List[Dict[str, Any]]):
+        """Embed non-empty chunks and append them to the index, creating it on first use."""
+        filtered_chunks = [chunk for chunk in chunks if chunk.get("content", "").strip()]
+        valid_texts = [chunk["content"].strip() for chunk in filtered_chunks]
+        skipped = len(chunks) - len(filtered_chunks)
+        if skipped:
+            logger.warning("⚠️ Skipping %s empty chunks", skipped)
+
+        # Embed and add in slices so at most one slice of vectors is resident beyond the index itself
+        for start in range(0, len(valid_texts), INDEX_ADD_BATCH_SIZE):
+            end = start + INDEX_ADD_BATCH_SIZE
+            self._add_batch(filtered_chunks[start:end], valid_texts[start:end])
+
+    def _add_batch(self, filtered_chunks: List[Dict[str, Any]], valid_texts: List[str]):
+        embeddings, kept = self.create_embeddings(valid_texts)
+        if len(kept) < len(filtered_chunks):
+            # A placeholder vector would match nothing and hide the failure, so the chunk stays out
+            filtered_chunks = [filtered_chunks[i] for i in kept]
+        if not filtered_chunks:
+            return
 
-        self.index = faiss.IndexFlatIP(self.dimension)
-        faiss.normalize_L2(embeddings)
+        if self.index is None:
+            self.index = faiss.IndexFlatIP(self.dimension)
+        self._materialize_index()
         self.index.add(embeddings)
-        self.chunks = filtered_chunks
+        self._maybe_build_graph()
+        self._maybe_partition_index()
+        self._maybe_move_to_gpu()
+        if isinstance(self.chunks, _LazyChunks):
+            self.chunks = table_to_chunks(self.chunks.table)  # one bulk decode, not a take per row
+        self.chunks.extend(filtered_chunks)
+        if len(self.chunks) > BRUTE_FORCE_MAX_CHUNKS:
+            self.embeddings = None
+        elif self.embeddings is None:
+            self.embeddings = embeddings
+        else:
+            grown = aligned_empty((len(self.embeddings) + len(embeddings), self.dimension), np.float32)
+            self.embeddings = np.concatenate([self.embeddings, embeddings], out=grown)
+        self.query_cache.clear()
 
-        print(f"✅ Built index with {len(filtered_chunks)} valid chunks")
+        logger.debug("Indexed %s chunks (%s total)", len(filtered_chunks), len(self.chunks))
 
-    def search(self, query: str, top_k: int = 5) -> List[Dict[str, Any]]:
+    def search(self, query: str, top_k: int = 5, nprobe: int = None) -> List[SearchResult]:
+        """Top-k chunks for a query; nprobe overrides IVF_NPROBE for partitioned indexes"""
         if self.index is None:
             return []
 
         query_embedding = self.create_query_embedding(query)
-        faiss.normalize_L2(query_embedding)
 
-        scores, indices = self.index.search(query_embedding, top_k)
+        # One cache entry per query, holding hits per search-parameter set so other nprobes never reuse them
+        params = (nprobe or IVF_NPROBE,)
+        entry = self.query_cache.lookup(query_embedding[0])
+        cached = entry.get(params) if entry is not None else None
+        if cached is not None and cached[0] >= top_k:
+            scores, indices = [cached[1][:top_k]], [cached[2][:top_k]]
+        else:
+            scores, indices = self._search_index(query_embedding, top_k, nprobe)
+            if entry is None:
+                entry = {}
+                self.query_cache.insert(query_embedding[0], entry)
+            entry[params] = (top_k, scores[0], indices[0])
+
+        n_chunks = len(self.chunks)
+        hits = [(int(idx), float(score)) for score, idx in zip(scores[0], indices[0]) if 0 <= idx < n_chunks]
+        positions = [idx for idx, _ in hits]
+        if isinstance(self.chunks, _LazyChunks):
+            chunks = self.chunks.take(positions)
+        else:
+            chunks = [self.chunks[idx] for idx in positions]
+        return [SearchResult(chunk, score) for chunk, (_, score) in zip(chunks, hits)]
+
+    def _search_index(self, query_embedding: np.ndarray, top_k: int, nprobe: int = None) -> Tuple[np.ndarray, np.ndarray]:
+        if self.embeddings is not None:
+            # Small corpus: rows are unit length, so one matmul gives cosine scores without a FAISS round-trip
+            similarities = self.embeddings @ query_embedding[0]
+            top_indices = _top_k(similarities, top_k)
+            scores, indices = [similarities[top_indices]], [top_indices]
+        elif nprobe and self._is_ivf():
+            scores, indices = self.index.search(query_embedding, top_k, params=faiss.SearchParametersIVF(nprobe=nprobe))
+        else:
+            scores, indices = self.index.search(query_embedding, top_k)
+        return scores, indices
+
+    def _maybe_build_graph(self):
+        """Rebuild the exact index as an HNSW graph once brute force is outgrown, for low single-query latency"""
+        if (VECTOR_INDEX_TYPE != "hnsw" or self._on_gpu or not isinstance(self.index, faiss.IndexFlat)
+                or self.index.ntotal <= BRUTE_FORCE_MAX_CHUNKS):
+            return
+        vectors = self.index.reconstruct_n(0, self.index.ntotal)
+        index = faiss.IndexHNSWFlat(self.dimension, HNSW_M, faiss.METRIC_INNER_PRODUCT)
+        index.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+        index.add(vectors)
+        self.index = index
+        self._apply_search_params()
+        logger.info("🕸️ Built HNSW graph over %s vectors", index.ntotal)
+
+    def _apply_search_params(self):
+        """Restore per-index query knobs, which FAISS does not persist for every index type"""
+        if isinstance(self.index, faiss.IndexIVF):
+            self.index.nprobe = IVF_NPROBE
+        elif isinstance(self.index, faiss.IndexHNSW):
+            self.index.hnsw.efSearch = HNSW_EF_SEARCH
 
-        results = []
-        for score, idx in zip(scores[0], indices[0]):
-            if idx < len(self.chunks):
-                chunk = self.chunks[idx].copy()
-                chunk['similarity_score'] = float(score)
-                results.append(chunk)
+    def _maybe_partition_index(self):
+        """Rebuild as an IVF index past IVF_MIN_CHUNKS so queries scan nprobe clusters, not every vector"""
+        if (VECTOR_INDEX_TYPE == "hnsw" or self._on_gpu or isinstance(self.index, faiss.IndexIVF)
+                or self.index.ntotal <= IVF_MIN_CHUNKS):
+            return
+        # Below IVF_MIN_CHUNKS the index stays exact, so training and encoding see the original float vectors
+        if isinstance(self.index, faiss.IndexScalarQuantizer):
+            logger.warning("⚠️ Partitioning an int8 index saved by an older build; vectors are already quantized")
+        vectors = self.index.reconstruct_n(0, self.index.ntotal)
+        nlist = int(4 * math.sqrt(len(vectors)))
+        quantizer = faiss.IndexFlatIP(self.dimension)
+        if VECTOR_INDEX_TYPE == "sq8":
+            index = faiss.IndexIVFScalarQuantizer(quantizer, self.dimension, nlist,
+                                                  faiss.ScalarQuantizer.QT_8bit, faiss.METRIC_INNER_PRODUCT)
+            # Ranges are fixed after training; widen them so vectors added later are clipped less
+            index.sq.rangestat = faiss.ScalarQuantizer.RS_minmax
+            index.sq.rangestat_arg = SQ8_RANGE_MARGIN
+        else:
+            index = faiss.IndexIVFFlat(quantizer, self.dimension, nlist, faiss.METRIC_INNER_PRODUCT)
+        index.train(vectors)
+        index.add(vectors)
+        index.nprobe = IVF_NPROBE
+        self._ivf_quantizer = quantizer  # the IVF index doesn't own its quantizer from Python
+        self.index = index
+        logger.info("🧭 Partitioned index with %s vectors into %s IVF lists", index.ntotal, nlist)
+
+    def _is_ivf(self) -> bool:
+        if isinstance(self.index, faiss.IndexIVF):
+            return True
+        return self._on_gpu and isinstance(self.index, faiss.GpuIndexIVF)
+
+    def _maybe_move_to_gpu(self):
+        """Keep large flat and IVF indexes resident on the GPU; small ones don't amortize the transfer"""
+        # IVF lists are copied with their nprobe; FAISS has no GPU version of HNSW or non-IVF SQ8
+        gpu_capable = isinstance(self.index, (faiss.IndexFlat, faiss.IndexIVFFlat, faiss.IndexIVFScalarQuantizer))
+        if self._on_gpu or not gpu_capable or self.index.ntotal < GPU_MIN_CHUNKS:
+            return
+        if not hasattr(faiss, "StandardGpuResources") or faiss.get_num_gpus() == 0:  # faiss-cpu build
+            return
+        if self._gpu_resources is None:
+            self._gpu_resources = faiss.StandardGpuResources()
+        self.index = faiss.index_cpu_to_gpu(self._gpu_resources, 0, self.index)
+        self._on_gpu = True
+        self._mapped_index_path = None  # the GPU copy no longer reads from the mapped file
+        logger.info("🚀 Moved index with %s vectors to GPU", self.index.ntotal)
 
-        return results
+    def _materialize_index(self):
+        """Read a memory-mapped index fully into RAM before it is modified or overwritten"""
+        if self._mapped_index_path is not None:
+            self.index = faiss.read_index(str(self._mapped_index_path))
+            self._mapped_index_path = None
+            self._apply_search_params()
 
     def save_index(self, filename: str):
         if self.index is not None:
             index_path = VECTORS_DIR / f"{filename}_index.faiss"
             chunks_path = VECTORS_DIR / f"{filename}_chunks.pkl"
+            table_path = VECTORS_DIR / f"{filename}_chunks.feather"
+            self._materialize_index()
 
-            faiss.write_index(self.index, str(index_path))
-            with open(chunks_path, 'wb') as f:
-                pickle.dump(self.chunks, f)
+            cpu_index = faiss.index_gpu_to_cpu(self.index) if self._on_gpu else self.index
+            faiss.write_index(cpu_index, str(index_path))
+            matrix_path = VECTORS_DIR / f"{filename}_embeddings.npy"
+            if self.embeddings is not None:
+                # self.embeddings may be a mmap view of matrix_path itself after load_index
+                _write_atomically(matrix_path, lambda tmp: np.save(tmp, self.embeddings))
+            elif matrix_path.exists():
+                matrix_path.unlink()  # stale matrix from a smaller build
+            if feather is None:
+                with open(chunks_path, 'wb') as f:
+                    pickle.dump(list(self.chunks), f)
+            else:
+                # The table may be memory-mapped from table_path itself, so it must not be truncated in place
+                table = self.chunks.table if isinstance(self.chunks, _LazyChunks) else chunks_to_table(self.chunks)
+                _write_atomically(table_path, lambda tmp: feather.write_feather(table, tmp, compression='lz4'))
+                if chunks_path.exists():
+                    chunks_path.unlink()  # superseded pickle from an older save
 
     def load_index(self, filename: str) -> bool:
         index_path = VECTORS_DIR / f"{filename}_index.faiss"
         chunks_path = VECTORS_DIR / f"{filename}_chunks.pkl"
+        table_path = VECTORS_DIR / f"{filename}_chunks.feather"
+        use_table = feather is not None and table_path.exists()
 
-        if index_path.exists() and chunks_path.exists():
-            self.index = faiss.read_index(str(index_path))
-            with open(chunks_path, 'rb') as f:
-                self.chunks = pickle.load(f)
+        if index_path.exists() and (use_table or chunks_path.exists()):
+            # Demand-paged and shareable across processes instead of copied into each one's RSS
+            self.index = faiss.read_index(str(index_path), faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+            self._mapped_index_path = index_path
+            self._on_gpu = False
+            self._apply_search_params()
+            self._maybe_move_to_gpu()
+            if use_table:
+                # Memory-mapped columns; row dicts are only built for chunks a search returns
+                self.chunks = _LazyChunks(feather.read_table(str(table_path), memory_map=True))
+            else:
+                with open(chunks_path, 'rb') as f:
+                    self.chunks = pickle.load(f)
+            matrix_path = VECTORS_DIR / f"{filename}_embeddings.npy"
+            if self.index.ntotal > BRUTE_FORCE_MAX_CHUNKS:
+                self.embeddings = None
+            elif matrix_path.exists():
+                self.embeddings = np.load(matrix_path, mmap_mode='r')
+            else:
+                self.embeddings = self.index.reconstruct_n(0, self.index.ntotal)
+            self.query_cache.clear()
             return True
         return False